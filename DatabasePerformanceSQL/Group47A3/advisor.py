@@ -0,0 +1,227 @@
+### Index advisor driven by EXPLAIN QUERY PLAN ###
+
+import argparse
+import importlib
+import re
+import shutil
+import subprocess
+import benchmark
+
+TABLES = ('Customers', 'Sellers', 'Orders', 'Order_items')
+
+# Relative gain over the no-index baseline a candidate needs to join the combined set
+MIN_GAIN = 0.05
+
+
+def explain(cursor, sql, params):
+    return [row[3] for row in cursor.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()]
+
+
+def table_aliases(sql):
+    #'Orders o' / 'Orders AS o' / bare 'Orders' -> {alias: table}
+    aliases = {table: table for table in TABLES}
+    pattern = r'\b({})\b(?:\s+(?:AS\s+)?(\w+))?'.format('|'.join(TABLES))
+    for table, alias in re.findall(pattern, sql, re.IGNORECASE):
+        if alias and alias.upper() not in ('WHERE', 'GROUP', 'ON', 'AND', 'ORDER', 'JOIN'):
+            aliases[alias] = table
+    return aliases
+
+
+def referenced_columns(cursor, table, sql):
+    #Columns of the table named in the query, those compared to a parameter first
+    columns = [row[1] for row in cursor.execute(f'PRAGMA table_info({table});')]
+    used = [col for col in columns if re.search(rf'\b{col}\b', sql)]
+    filters = [col for col in used if re.search(rf'\b{col}\s*=\s*\?', sql)]
+    return filters + [col for col in used if col not in filters]
+
+
+def index_statement(table, columns):
+    name = 'adv_{}_{}'.format(table, '_'.join(columns))
+    return f"CREATE INDEX {name} ON {table} ({', '.join(columns)});"
+
+
+def automatic_candidates(plan, aliases):
+    #With automatic_index on, SQLite spells out the transient indexes it
+    #would build for each loop; each one is a persistent index candidate
+    candidates = []
+    for detail in plan:
+        match = re.match(r'SEARCH (\w+) USING AUTOMATIC (?:PARTIAL )?(?:COVERING )?INDEX \(([^)]*)\)', detail)
+        if match and match.group(1) in aliases:
+            columns = re.findall(r'(\w+)[=<>]', match.group(2))
+            candidates.append((aliases[match.group(1)], tuple(columns)))
+    return candidates
+
+
+def scan_candidates(cursor, plan, aliases, sql):
+    #Every full SCAN of a base table gets a single-column index on its leading
+    #referenced column, a composite of its first two, and a covering index
+    candidates = []
+    for detail in plan:
+        match = re.match(r'SCAN (\w+)(?: USING (?:COVERING )?INDEX \w+)?$', detail)
+        if not match or match.group(1) not in aliases:
+            continue
+        table = aliases[match.group(1)]
+        columns = referenced_columns(cursor, table, sql)
+        if not columns:
+            continue
+        candidates.append((table, (columns[0],)))
+        if len(columns) > 1:
+            candidates.append((table, tuple(columns[:2])))
+            candidates.append((table, tuple(columns)))
+    return candidates
+
+
+def filter_candidates(cursor, aliases, sql):
+    #Columns compared to a parameter are where a plan should start, whether or
+    #not the current plan starts there
+    candidates = []
+    for table in dict.fromkeys(aliases.values()):
+        if not re.search(rf'\b{table}\b', sql):
+            continue
+        columns = referenced_columns(cursor, table, sql)
+        for col in columns:
+            if re.search(rf'\b{col}\s*=\s*\?', sql):
+                candidates.append((table, (col,)))
+                if len(columns) > 1:
+                    candidates.append((table, (col,) + tuple(c for c in columns if c != col)))
+    return candidates
+
+
+def join_candidates(cursor, aliases, sql):
+    #Both sides of every 'x.col = y.col' join: the inner loop of a join looks
+    #its rows up by that column
+    candidates = []
+    for pair in re.findall(r'\b(\w+)\.(\w+)\s*=\s*(\w+)\.(\w+)', sql):
+        for alias, col in (pair[:2], pair[2:]):
+            if alias not in aliases:
+                continue
+            table = aliases[alias]
+            if col in [row[1] for row in cursor.execute(f'PRAGMA table_info({table});')]:
+                candidates.append((table, (col,)))
+    return candidates
+
+
+def expert_candidates(path, sql):
+    #The sqlite3 shell's .expert recommends indexes directly; only used when
+    #the shell is installed
+    if shutil.which('sqlite3') is None:
+        return []
+    statement = sql.strip().rstrip(';') + ';\n'
+    try:
+        output = subprocess.run(['sqlite3', path], input='.expert\n' + statement, text=True,
+                                capture_output=True, timeout=60).stdout
+    except (OSError, subprocess.SubprocessError):
+        return []
+    candidates = []
+    for table, columns in re.findall(r'CREATE INDEX \w+ ON (\w+)\(([^)]*)\);', output):
+        candidates.append((table, tuple(col.split()[0] for col in columns.split(','))))
+    return candidates
+
+
+def propose(query, path, params):
+    connection = benchmark.connect(path)
+    cursor = connection.cursor()
+    cursor.execute('PRAGMA automatic_index = TRUE;')
+    if 'setup' in query:
+        query['setup'](cursor)
+        connection.commit()
+    try:
+        plan = explain(cursor, query['sql'], params)
+        aliases = table_aliases(query['sql'])
+        candidates = (automatic_candidates(plan, aliases)
+                      + scan_candidates(cursor, plan, aliases, query['sql'])
+                      + filter_candidates(cursor, aliases, query['sql'])
+                      + join_candidates(cursor, aliases, query['sql'])
+                      + expert_candidates(path, query['sql']))
+    finally:
+        if 'teardown' in query:
+            query['teardown'](cursor)
+        connection.commit()
+        connection.close()
+
+    #Keep the first occurrence of each (table, columns)
+    return list(dict.fromkeys((table, columns) for table, columns in candidates if columns))
+
+
+def drop_prefixes(candidates):
+    #An index whose columns lead another index on the same table serves no
+    #lookup the longer one cannot
+    return [(table, columns) for table, columns in candidates
+            if not any(other == table and len(longer) > len(columns) and longer[:len(columns)] == columns
+                       for other, longer in candidates)]
+
+
+def measure(query, label, path, indexes, params, options):
+    trial = dict(query, indexes=indexes)
+    return benchmark.run_cell(trial, label, path, 'User-Optimized', params, options)
+
+
+def advise(query, label, path, options=None):
+    options = dict(benchmark.OPTIONS, **(options or {}))
+    benchmark.recover(path, query)
+    params = benchmark.draw_params(query, path, options['warmup'] + options['repeat'], options['seed'])
+    candidates = propose(query, path, params[0])
+
+    #No-index baseline, the hand-picked set, each candidate alone, then every
+    #candidate that beat the baseline on its own combined
+    configurations = [('no indexes', []), ('hand-picked', query.get('indexes', []))]
+    configurations += [(f'{table}({", ".join(columns)})', [index_statement(table, columns)])
+                       for table, columns in candidates]
+
+    report = []
+    for name, indexes in configurations:
+        record = measure(query, label, path, indexes, params, options)
+        report.append({'configuration': name, 'indexes': indexes, 'mean_ms': record['mean_ms'],
+                       'p95_ms': record['p95_ms']})
+
+    baseline = report[0]['mean_ms']
+    winners = [candidate for candidate, r in zip(candidates, report[2:])
+               if r['mean_ms'] < baseline * (1 - MIN_GAIN)]
+    winners = drop_prefixes(winners)
+    if len(winners) > 1:
+        indexes = [index_statement(table, columns) for table, columns in winners]
+        record = measure(query, label, path, indexes, params, options)
+        report.append({'configuration': 'combined', 'indexes': indexes, 'mean_ms': record['mean_ms'],
+                       'p95_ms': record['p95_ms']})
+
+    for r in report:
+        r['speedup'] = baseline / r['mean_ms'] if r['mean_ms'] > 0 else float('inf')
+    return report
+
+
+def print_report(query, label, report):
+    print(f"{query['name']} on {label}")
+    for r in report:
+        print(f"  {r['configuration']:<50} {r['mean_ms']:10.3f} ms  p95 {r['p95_ms']:10.3f} ms  x{r['speedup']:.2f}")
+    best = min(report, key=lambda r: r['mean_ms'])
+    print(f"Best: {best['configuration']} (x{best['speedup']:.2f} over no indexes)")
+    for statement in best['indexes']:
+        print(f"  {statement}")
+    return best
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Proposes and benchmarks indexes for a Q*A3 query')
+    parser.add_argument('query', help='query module, e.g. Q2A3')
+    parser.add_argument('--db', type=benchmark.parse_database, metavar='LABEL=PATH',
+                        default=benchmark.DATABASES[-1], help='database to tune (default: the largest tier)')
+    parser.add_argument('--repeat', type=int, default=benchmark.REPEAT)
+    parser.add_argument('--warmup', type=int, default=benchmark.WARMUP)
+    parser.add_argument('--seed', type=int, default=benchmark.SEED)
+    parser.add_argument('--results', metavar='JSON', help='write the report to this file')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    query = importlib.import_module(args.query).QUERY
+    label, path = args.db
+    report = advise(query, label, path, {'repeat': args.repeat, 'warmup': args.warmup, 'seed': args.seed})
+    print_report(query, label, report)
+    if args.results:
+        benchmark.save_results(report, args.results)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,988 @@
+### Benchmark harness shared by Q1A3-Q4A3 ###
+
+import argparse
+import difflib
+import hashlib
+import json
+import os
+import re
+import resource
+import shutil
+import sqlite3
+import time
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import columnar
+import ordersize
+import postalindex
+import querycache
+
+# (chart label, database path)
+DATABASES = (
+    ("SmallDB", "./A3Small.db"),
+    ("MediumDB", "./A3Medium.db"),
+    ("LargeDB", "./A3Large.db"),
+)
+
+# How each strategy prepares a connection before the timed runs.
+# 'constraints': False runs against the twin database without PK/FK,
+# 'indexes' names the key of the query definition holding its CREATE INDEX list
+# (queries without that key skip the strategy),
+# 'sql' the key holding the statement to run (queries without it skip the strategy),
+# 'setup'/'teardown' build and remove strategy-specific objects around the cell,
+# 'engine' answers the query outside SQLite from a structure built per cell
+# (queries missing from the engine's ANSWERS skip the strategy)
+STRATEGIES = {
+    'Uninformed': {'automatic_index': False, 'constraints': False, 'indexes': None},
+    'Self-Optimized': {'automatic_index': True, 'constraints': True, 'indexes': None},
+    'User-Optimized': {'automatic_index': False, 'constraints': True, 'indexes': 'indexes'},
+    #Same database with its keys but nothing built on top: what index sets and
+    #setup are paid back against
+    'No-Index': {'automatic_index': False, 'constraints': True, 'indexes': None},
+    #Composite indexes designed per query so each join step is read from an
+    #index without touching table rows, e.g. postal code -> customer ids ->
+    #order ids for Q1-Q3; per-order item counts need none, the Order_items
+    #key already leads with order_id
+    'User-Optimized v2': {'automatic_index': False, 'constraints': True, 'indexes': 'covering_indexes'},
+    #Starts from customer_postal_code and walks Customers -> Orders by index,
+    #then looks each order's size up in MatOrderSize by its key
+    'Materialized': {'automatic_index': False, 'constraints': True, 'indexes': 'materialized_indexes',
+                     'sql': 'materialized_sql',
+                     'setup': ordersize.create_order_size, 'teardown': ordersize.drop_order_size},
+    'Postal-Index': {'automatic_index': False, 'constraints': True, 'indexes': None,
+                     'engine': postalindex},
+    'Columnar': {'automatic_index': False, 'constraints': True, 'indexes': None,
+                 'engine': columnar},
+}
+
+# Named PRAGMA sets applied to every connection a cell opens. page_size only
+# changes with a VACUUM, so it is recorded rather than set
+PROFILES = {
+    'default': {},
+    'mmap-all': {'mmap_size': 2147418112},  #SQLite's default upper limit, i.e. the whole file
+    'large-cache': {'cache_size': -262144},  #256 MiB
+    'memory-temp-store': {'temp_store': 'MEMORY'},
+}
+PROFILE_PRAGMAS = ('mmap_size', 'cache_size', 'temp_store', 'page_size')
+
+# Strategies run when none are named on the command line
+DEFAULT_STRATEGIES = ('Uninformed', 'Self-Optimized', 'User-Optimized')
+
+REPEAT = 50
+WARMUP = 5
+SEED = 72
+
+# Settings shared by every cell of a run; overridden from the command line
+OPTIONS = {
+    'repeat': REPEAT,
+    'warmup': WARMUP,
+    'seed': SEED,
+    'drain': 'fetchall',  #'fetchall' keeps the rows for checking, 'count' only streams them
+    'cache': 'off',  #'on'/'both' also run queries with 'cached_sql' through the scalar cache
+    'statement_cache': None,  #sqlite3 cached_statements per connection, None for the module default
+    'baseline': 'No-Index',  #strategy an index set's build time is paid back against
+    'mode': 'warm',  #'warm' steady state on one connection, 'cold' a fresh connection per run, or 'both'
+    'evict': 'none',  #cold runs: also drop the file from the OS cache ('fadvise') or read a fresh copy ('copy')
+    'profiles': ('default',),  #PROFILES the matrix is run under, one pass each
+    'memory': False,  #run every cell against shared-cache in-memory copies of the databases
+    'plan_baseline': None,  #JSON file of stored plans each cell's plan is compared against
+    'update_plan_baseline': False,  #write this run's plans into plan_baseline
+}
+
+# Compilations timed per cell to estimate the prepare cost of its statement
+PREPARE_SAMPLES = 10
+
+
+# Counters kept from /proc/self/io (Linux only) and getrusage page faults
+IO_COUNTERS = ('rchar', 'syscr', 'read_bytes', 'minflt', 'majflt')
+
+
+# sqlite_stmt columns (the SQLITE_STMTSTATUS_* counters of a compiled
+# statement) summed over a cell's timed runs, under the names they are stored as
+STMT_COUNTERS = {
+    'nstep': 'vm_steps',
+    'nscan': 'full_scan_steps',
+    'nsort': 'sorts',
+    'naidx': 'auto_index_rows',
+}
+
+# VM instructions between progress handler calls when sqlite_stmt cannot be
+# used; the counting pass is untimed, so every instruction is counted
+PROGRESS_OPS = 1
+
+
+# Resamples used for the bootstrap confidence interval of the mean
+BOOTSTRAP = 2000
+CONFIDENCE = 0.95
+
+
+def connect(path, cached_statements=None, profile='default'):
+    #The connection's statement cache holds each compiled statement, keyed by
+    #its SQL text, for reuse by later executes
+    if cached_statements is None:
+        connection = sqlite3.connect(path, uri=is_memory(path))
+    else:
+        connection = sqlite3.connect(path, cached_statements=cached_statements, uri=is_memory(path))
+    cursor = connection.cursor()
+    cursor.execute('PRAGMA foreign_keys=ON;')
+    for name, value in PROFILES[profile].items():
+        cursor.execute(f'PRAGMA {name} = {value};')
+    connection.commit()
+    return connection
+
+
+def read_pragmas(cursor):
+    #Values in effect, which can differ from the profile (e.g. mmap_size is
+    #capped at compile time, and has no value at all for in-memory databases)
+    pragmas = {}
+    for name in PROFILE_PRAGMAS:
+        row = cursor.execute(f'PRAGMA {name};').fetchone()
+        pragmas[name] = row[0] if row else None
+    return pragmas
+
+
+def memory_uri(path):
+    #Every connection opening this URI shares one in-memory database, which
+    #lives as long as at least one of them stays open
+    return f"file:{path}?mode=memory&cache=shared"
+
+
+def is_memory(path):
+    return path.startswith('file:') and 'mode=memory' in path
+
+
+def load_into_memory(path):
+    #Copies the file into its shared in-memory database with the backup API
+    #and returns the URI plus the connection that keeps it alive
+    uri = memory_uri(path)
+    keeper = sqlite3.connect(uri, uri=True)
+    source = sqlite3.connect(path)
+    try:
+        source.backup(keeper)
+    finally:
+        source.close()
+    return uri, keeper
+
+
+def twin_path(path):
+    #./A3Small.db -> ./A3Small.nopk.db, also inside an in-memory URI
+    path, sep, query = path.partition('?')
+    root, ext = os.path.splitext(path)
+    return f"{root}.nopk{ext}{sep}{query}"
+
+
+def source_signature(cursor, schema='main'):
+    #Row count and last rowid of every table: cheap, and unlike the file
+    #mtime it does not change when a cell creates and drops indexes
+    tables = cursor.execute(
+        f"SELECT name, sql LIKE '%WITHOUT ROWID%' FROM {schema}.sqlite_master WHERE type = 'table' "
+        "AND name NOT LIKE 'sqlite_%' AND name != 'twin_source' ORDER BY name;").fetchall()
+    signature = []
+    for table, without_rowid in tables:
+        #WITHOUT ROWID tables (e.g. builddb's Key_map) only have a row count
+        last = 'NULL' if without_rowid else 'max(rowid)'
+        count, last = cursor.execute(f'SELECT count(*), {last} FROM {schema}.{table};').fetchone()
+        signature.append(f'{table}:{count}:{last}')
+    return ' '.join(signature)
+
+
+def twin_is_current(path, twin):
+    if not os.path.exists(twin):
+        return False
+    connection = sqlite3.connect(twin)
+    cursor = connection.cursor()
+    try:
+        row = cursor.execute('SELECT signature FROM twin_source;').fetchone()
+        cursor.execute('ATTACH DATABASE ? AS source;', (path,))
+        current = source_signature(cursor, 'source')
+    except sqlite3.DatabaseError:
+        return False
+    finally:
+        connection.close()
+    return row is not None and row[0] == current
+
+
+def ensure_twin(path):
+    #The Uninformed variant of a database is the same data in tables without
+    #PK/FK, built once into a sibling file and rebuilt only when the source
+    #changes. Built in a temp file and renamed so a crash never leaves a
+    #half-copied twin behind
+    twin = twin_path(path)
+    if twin_is_current(path, twin):
+        return twin
+
+    tmp = twin + '.tmp'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    connection = sqlite3.connect(tmp)
+    cursor = connection.cursor()
+    cursor.execute('ATTACH DATABASE ? AS source;', (path,))
+    tables = [row[0] for row in cursor.execute(
+        "SELECT name FROM source.sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%';").fetchall()]
+    for table in tables:
+        columns = cursor.execute(f'PRAGMA source.table_info({table});').fetchall()
+        definition = ', '.join(f'{col[1]} {col[2]}'.strip() for col in columns)
+        cursor.execute(f'CREATE TABLE main.{table} ({definition});')
+        cursor.execute(f'INSERT INTO main.{table} SELECT * FROM source.{table};')
+    cursor.execute('CREATE TABLE twin_source (signature TEXT);')
+    cursor.execute('INSERT INTO twin_source VALUES (?);', (source_signature(cursor, 'source'),))
+    connection.commit()
+    cursor.execute('DETACH DATABASE source;')
+    connection.close()
+    os.replace(tmp, twin)
+    return twin
+
+
+def recover(path, query=None):
+    #Startup check for a database left behind by a crashed run: tables still
+    #renamed by the old uninform()/reinform() copy, and indexes or views a
+    #cell created but never removed
+    connection = sqlite3.connect(path)
+    cursor = connection.cursor()
+    cursor.execute('PRAGMA foreign_keys=OFF;')
+    names = {row[0] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table';")}
+    repaired = []
+    for table in ('Customers', 'Sellers', 'Orders', 'Order_items'):
+        if f'pk_{table}' in names:
+            if table in names:
+                cursor.execute(f'DROP TABLE {table};')
+            cursor.execute(f'ALTER TABLE pk_{table} RENAME TO {table};')
+            repaired.append(table)
+        if f'nopk_{table}' in names:
+            cursor.execute(f'DROP TABLE nopk_{table};')
+            repaired.append(f'nopk_{table}')
+    for strategy in STRATEGIES.values():
+        if 'teardown' in strategy:
+            strategy['teardown'](cursor)
+    #Indexes an advisor.py trial created but never dropped
+    for (name,) in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' "
+                                  "AND name LIKE 'adv\\_%' ESCAPE '\\';").fetchall():
+        cursor.execute(f'DROP INDEX {name};')
+        repaired.append(name)
+    if query is not None:
+        for strategy in STRATEGIES.values():
+            if strategy['indexes']:
+                drop_indexes(cursor, query.get(strategy['indexes'], []))
+        if 'teardown' in query:
+            try:
+                query['teardown'](cursor)
+            except sqlite3.OperationalError:
+                pass
+    connection.commit()
+    connection.close()
+    if repaired:
+        print(f"Recovered {path}: restored {', '.join(repaired)}")
+    return repaired
+
+
+def index_name(statement):
+    #'CREATE INDEX <name> ON ...'
+    return statement.split()[2]
+
+
+def create_indexes(cursor, statements):
+    for statement in statements:
+        cursor.execute(statement)
+
+
+def drop_indexes(cursor, statements):
+    for statement in statements:
+        cursor.execute(f'DROP INDEX IF EXISTS {index_name(statement)};')
+
+
+def used_bytes(cursor):
+    #Pages in use, leaving out the free list that dropped indexes return to
+    page_count = cursor.execute('PRAGMA page_count;').fetchone()[0]
+    freelist = cursor.execute('PRAGMA freelist_count;').fetchone()[0]
+    page_size = cursor.execute('PRAGMA page_size;').fetchone()[0]
+    return (page_count - freelist) * page_size
+
+
+def index_pages(cursor, names):
+    #Pages and bytes of each index from the dbstat virtual table, None when
+    #SQLite was built without it
+    if not names:
+        return {}
+    try:
+        rows = cursor.execute('SELECT name, count(*), sum(pgsize) FROM dbstat WHERE name IN ({}) GROUP BY name;'
+                              .format(','.join('?' * len(names))), names).fetchall()
+    except sqlite3.OperationalError:
+        return None
+    return {name: {'pages': pages, 'bytes': size} for name, pages, size in rows}
+
+
+def break_even(results, baseline):
+    #Executions after which an index set and setup have paid back their build
+    #time: build_cost_ms over the per-query saving against the baseline strategy
+    #on the same database. None if the baseline did not run, inf if it never pays back
+    baselines = {(r['database'], r['cached'], r['mode'], r['profile']): r
+                 for r in results if r['strategy'] == baseline}
+    for record in results:
+        if 'build_cost_ms' not in record:
+            continue
+        reference = baselines.get((record['database'], record['cached'], record['mode'], record['profile']))
+        if reference is None:
+            record['break_even'] = None
+            continue
+        saving = reference['mean_ms'] - record['mean_ms']
+        record['baseline'] = baseline
+        record['saving_ms'] = saving
+        record['break_even'] = int(np.ceil(record['build_cost_ms'] / saving)) if saving > 0 else float('inf')
+    return results
+
+
+def rowid_sampler(table, column):
+    #O(log n) random row: pick a rowid below max(rowid) and look it up,
+    #returning None on a gap so the caller draws again
+    def sample(cursor, rng):
+        max_rowid = cursor.execute(f'SELECT max(rowid) FROM {table};').fetchone()[0]
+        rowid = int(rng.integers(1, max_rowid + 1))
+        return cursor.execute(f'SELECT {column} FROM {table} WHERE rowid = ?;', (rowid,)).fetchone()
+    return sample
+
+
+random_postal_code = rowid_sampler('Customers', 'customer_postal_code')
+
+
+def draw_params(query, path, count, seed=SEED):
+    #Parameters are drawn up front so sampling never lands inside the timed
+    #window, and the same sequence can be replayed in every cell of a database.
+    #Tiers are independent samples that share few keys, so each database
+    #draws its own
+    connection = connect(path)
+    cursor = connection.cursor()
+    rng = np.random.default_rng(seed)
+    params = []
+    attempts = 0
+    try:
+        while len(params) < count:
+            attempts += 1
+            if attempts > count * 1000:
+                raise RuntimeError(f"could not draw {count} parameters for {query['name']} from {path}")
+            row = query['params'](cursor, rng)
+            if row is not None:
+                params.append(tuple(row))
+    finally:
+        connection.close()
+    return params
+
+
+def applies(query, strategy_name, cached=False):
+    strategy = STRATEGIES[strategy_name]
+    if strategy['indexes'] and strategy['indexes'] not in query:
+        return False
+    if 'engine' in strategy:
+        return not cached and query['name'] in strategy['engine'].ANSWERS
+    sql_key = strategy.get('sql', 'sql')
+    if cached:
+        #The cached variant replaces the plain statement only
+        return sql_key == 'sql' and 'cached_sql' in query
+    return sql_key in query
+
+
+def run_query(cursor, sql, params, drain='fetchall'):
+    #sqlite3 only steps a statement as far as the first row, so the result is
+    #always drained to time the full execution
+    cursor.execute(sql, params)
+    if drain == 'count':
+        return sum(1 for row in cursor)
+    return cursor.fetchall()
+
+
+def digest(rows):
+    #Order-insensitive fingerprint of a result set
+    return hashlib.sha1(repr(sorted(rows)).encode()).hexdigest()[:16]
+
+
+def plan_fingerprint(cursor, sql, params):
+    #EXPLAIN QUERY PLAN as indented lines, one per plan node under its parent,
+    #with the subquery numbers SQLite assigns while compiling masked out
+    depth = {0: -1}
+    lines = []
+    for node, parent, _, detail in cursor.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall():
+        depth[node] = depth.get(parent, -1) + 1
+        lines.append('  ' * depth[node] + re.sub(r'(SUBQUERY|CO-ROUTINE) \d+', r'\1 N', detail))
+    return lines
+
+
+def plan_hash(lines):
+    return hashlib.sha1('\n'.join(lines).encode()).hexdigest()[:12]
+
+
+def plan_key(record):
+    return f"{record['query']} {record['database']} {record['series']}"
+
+
+def load_plans(filename):
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def plan_diff(old, new, old_name, new_name):
+    return '\n'.join(difflib.unified_diff(old, new, old_name, new_name, lineterm=''))
+
+
+def compare_plans(results, filename=None, update=False):
+    #Flags each cell whose plan differs from the stored baseline, and each tier
+    #whose plan differs from the first tier's for the same series
+    baseline = load_plans(filename) if filename else {}
+    first = {}
+    for record in results:
+        if record['plan'] is None:
+            continue
+        reference = first.setdefault(record['series'], record)
+        if reference['plan_hash'] != record['plan_hash']:
+            print(f"NOTE: {record['query']} {record['series']} plan differs between "
+                  f"{reference['database']} and {record['database']}")
+            print(plan_diff(reference['plan'], record['plan'], reference['database'], record['database']))
+        stored = baseline.get(plan_key(record))
+        record['plan_changed'] = None if stored is None else stored != record['plan']
+        if record['plan_changed']:
+            print(f"WARNING: {plan_key(record)} plan differs from the baseline in {filename}")
+            print(plan_diff(stored, record['plan'], 'baseline', 'this run'))
+    if filename and update:
+        baseline.update({plan_key(r): r['plan'] for r in results if r['plan'] is not None})
+        with open(filename, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+    return results
+
+
+def check_results(results):
+    #Every strategy must return the same result for the same parameter in the
+    #same database; mismatching run indexes are recorded on each record
+    by_database = {}
+    for record in results:
+        by_database.setdefault(record['database'], []).append(record)
+    for records in by_database.values():
+        key = 'digests' if all('digests' in r for r in records) else 'rows'
+        reference = records[0]
+        for record in records:
+            record['mismatches'] = [i for i, (a, b) in enumerate(zip(record[key], reference[key]))
+                                    if a != b]
+            if record['mismatches']:
+                print(f"WARNING: {record['query']} {record['database']} {record['series']} differs from "
+                      f"{reference['series']} on {len(record['mismatches'])} of {len(record[key])} runs")
+    return results
+
+
+def measure_prepare(path, sql, params, automatic_index, samples=PREPARE_SAMPLES, profile='default'):
+    #sqlite3 has no prepare-only call, so compile 'EXPLAIN <sql>' on a
+    #connection without a statement cache: that parses and plans the full
+    #statement and generates its bytecode, but stepping it only lists opcodes
+    connection = connect(path, cached_statements=0, profile=profile)
+    cursor = connection.cursor()
+    auto = 'TRUE' if automatic_index else 'FALSE'
+    cursor.execute(f'PRAGMA automatic_index = {auto};')
+    times_ms = []
+    try:
+        for i in range(samples):
+            start_time = time.perf_counter()
+            cursor.execute('EXPLAIN ' + sql, params)
+            times_ms.append((time.perf_counter() - start_time) * 1000)
+    finally:
+        connection.close()
+    return float(np.median(times_ms))
+
+
+def io_counters():
+    counters = {}
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                name, value = line.split(':')
+                counters[name] = int(value)
+    except OSError:
+        pass
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    counters['minflt'] = usage.ru_minflt
+    counters['majflt'] = usage.ru_majflt
+    return counters
+
+
+def io_delta(before, after):
+    return {name: after[name] - before[name] for name in IO_COUNTERS if name in before and name in after}
+
+
+def evict_file(path):
+    #Only clean pages can be dropped from the OS cache, so flush first;
+    #a no-op where posix_fadvise is missing
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    for name in (path, path + '-wal'):
+        if os.path.exists(name):
+            fd = os.open(name, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            finally:
+                os.close(fd)
+    return
+
+
+def cold_target(path, evict):
+    #The file a cold run opens: the database itself, evicted from the OS cache
+    #with 'fadvise', or with 'copy' a new file (new inode, no cached pages).
+    #In-memory databases have no file to evict
+    if is_memory(path):
+        return path
+    if evict == 'copy':
+        copy = path + '.cold'
+        shutil.copyfile(path, copy)
+        evict_file(copy)
+        return copy
+    if evict == 'fadvise':
+        evict_file(path)
+    return path
+
+
+def stmt_counters(connection, sql):
+    #Cumulative counters of the connection's compiled copy of sql, None when
+    #SQLite lacks the sqlite_stmt table or the statement is not in the cache.
+    #The stored text stops at the statement's end, so trailing whitespace is
+    #trimmed on both sides
+    try:
+        row = connection.execute('SELECT run, {} FROM sqlite_stmt WHERE rtrim(sql, char(32, 9, 10, 13)) = ?;'
+                                 .format(', '.join(STMT_COUNTERS)), (sql.rstrip(),)).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return dict(zip(('runs',) + tuple(STMT_COUNTERS.values()), row)) if row else None
+
+
+def engine_counters(connection, sql, run, runs):
+    #Counters summed over an untimed pass of run(i) for every i in runs, with
+    #one sqlite_stmt reading on either side. They only hold if the cached
+    #statement ran once per call, i.e. it was not evicted and re-prepared
+    #along the way (a small statement cache); otherwise VM steps are counted
+    #by a progress handler over a second pass
+    before = stmt_counters(connection, sql)
+    if before is not None:
+        for i in runs:
+            run(i)
+        after = stmt_counters(connection, sql)
+        if after is not None and after['runs'] - before['runs'] == len(runs):
+            counters = {name: after[name] - before[name] for name in STMT_COUNTERS.values()}
+            counters['source'] = 'sqlite_stmt'
+            return counters
+
+    counters = {'source': 'progress_handler', 'vm_steps': 0}
+
+    def tick():
+        counters['vm_steps'] += PROGRESS_OPS
+        return 0
+    connection.set_progress_handler(tick, PROGRESS_OPS)
+    try:
+        for i in runs:
+            run(i)
+    finally:
+        connection.set_progress_handler(None, 0)
+    return counters
+
+
+def summarize(times_ms, seed=0):
+    times_ms = np.asarray(times_ms, dtype=float)
+    rng = np.random.default_rng(seed)
+    boot = rng.choice(times_ms, (BOOTSTRAP, len(times_ms))).mean(axis=1)
+    tail = (1 - CONFIDENCE) / 2 * 100
+    ci_low, ci_high = np.percentile(boot, [tail, 100 - tail])
+    p50, p95, p99 = np.percentile(times_ms, [50, 95, 99])
+    return {
+        'mean_ms': float(times_ms.mean()),
+        'stddev_ms': float(times_ms.std(ddof=1)) if len(times_ms) > 1 else 0.0,
+        'min_ms': float(times_ms.min()),
+        'max_ms': float(times_ms.max()),
+        'p50_ms': float(p50),
+        'p95_ms': float(p95),
+        'p99_ms': float(p99),
+        'ci_low_ms': float(ci_low),
+        'ci_high_ms': float(ci_high),
+    }
+
+
+def run_cell(query, label, path, strategy_name, params, options=OPTIONS, cached=False, cold=False):
+    strategy = STRATEGIES[strategy_name]
+    repeat, warmup = options['repeat'], options['warmup']
+    indexes = query.get(strategy['indexes'], []) if strategy['indexes'] else []
+    engine = strategy.get('engine')
+    sql = None
+    if engine is None:
+        sql = query['cached_sql'] if cached else query[strategy.get('sql', 'sql')]
+
+    target = path if strategy['constraints'] else twin_path(path)
+    #Run by run_matrix once per entry of options['profiles']
+    profile = options.get('profile', 'default')
+    connection = connect(target, options['statement_cache'], profile)
+    cursor = connection.cursor()
+    pragmas = read_pragmas(cursor)
+    auto = 'TRUE' if strategy['automatic_index'] else 'FALSE'
+    cursor.execute(f'PRAGMA automatic_index = {auto};')
+    #Index build time and on-disk size, outside the timed runs
+    index_bytes = used_bytes(cursor)
+    start_time = time.perf_counter()
+    create_indexes(cursor, indexes)
+    connection.commit()
+    index_ms = (time.perf_counter() - start_time) * 1000
+    index_bytes = used_bytes(cursor) - index_bytes
+    pages = index_pages(cursor, [index_name(statement) for statement in indexes])
+    #Views, summary tables and triggers are part of the build cost as well
+    start_time = time.perf_counter()
+    if 'setup' in query:
+        query['setup'](cursor)
+    if 'setup' in strategy:
+        strategy['setup'](cursor)
+    connection.commit()
+    setup_ms = (time.perf_counter() - start_time) * 1000
+    cache = querycache.attach_cache(cursor) if cached else None
+    drain = options['drain']
+    build_ms = 0.0
+    if engine is not None:
+        start_time = time.perf_counter()
+        index = engine.build_index(cursor)
+        build_ms = (time.perf_counter() - start_time) * 1000
+        answer = engine.ANSWERS[query['name']]
+    #Plan capture and the prepare timing bind the scalar cache slots as NULL
+    #rather than going through the cache
+    plan = None
+    if engine is None:
+        unbound = params[0] + ((None,) * len(query['scalars']) if cached else ())
+        plan = plan_fingerprint(cursor, sql, unbound)
+
+    def bind(i):
+        #With the cache, the parameter-independent scalars are looked up (or
+        #computed on a miss) inside the timed window and bound after the params
+        if cache is None:
+            return params[i]
+        return params[i] + tuple(querycache.cached_scalar(cursor, cache, s) for s in query['scalars'])
+
+    def run(i):
+        if engine is not None:
+            result = answer(index, params[i])
+            return len(result) if drain == 'count' else result
+        return run_query(cursor, sql, bind(i), drain)
+
+    def run_cold(i, file):
+        #Open, configure, run and close: the timed window covers a client's
+        #whole cold start, with an empty SQLite page cache every time
+        cold_connection = connect(file, options['statement_cache'], profile)
+        try:
+            cold_connection.execute(f'PRAGMA automatic_index = {auto};')
+            return run_query(cold_connection.cursor(), sql, params[i], drain)
+        finally:
+            cold_connection.close()
+
+    try:
+        #The warmup also compiles the statement into the connection's cache
+        for i in range(warmup):
+            run(i)
+        connection.commit()
+        prepare_ms = 0.0
+        if engine is None:
+            prepare_ms = measure_prepare(target, sql, unbound, strategy['automatic_index'], profile=profile)
+
+        #Engine counters of warm SQL runs, from an untimed pass over the same
+        #parameters so nothing is read or hooked in while timing
+        counters = None
+        if engine is None and not cold:
+            counters = engine_counters(connection, sql, run, range(warmup, warmup + repeat))
+
+        #The warmup fills the scalar cache, so the timed runs are the steady
+        #state of hits; the counters are reset to count those runs only
+        if cache is not None:
+            cache['hits'] = cache['misses'] = 0
+        times_ms = []
+        rows = []
+        digests = []
+        io = dict.fromkeys(IO_COUNTERS, 0)
+        for i in range(warmup, warmup + repeat):
+            if cold:
+                file = cold_target(target, options['evict'])
+            before = io_counters()
+            start_time = time.perf_counter()
+            result = run_cold(i, file) if cold else run(i)
+            times_ms.append((time.perf_counter() - start_time) * 1000)
+            for name, value in io_delta(before, io_counters()).items():
+                io[name] += value
+            if cold and file != target:
+                os.remove(file)
+            if drain == 'count':
+                rows.append(result)
+            else:
+                rows.append(len(result))
+                digests.append(digest(result))
+    finally:
+        if cache is not None:
+            querycache.detach_cache(cursor, cache)
+        if 'teardown' in strategy:
+            strategy['teardown'](cursor)
+        if 'teardown' in query:
+            query['teardown'](cursor)
+        drop_indexes(cursor, indexes)
+        connection.commit()
+        connection.close()
+
+    record = {
+        'query': query['name'],
+        'database': label,
+        'path': path,
+        'strategy': strategy_name,
+        'cached': cached,
+        'mode': 'cold' if cold else 'warm',
+        'evict': options['evict'] if cold else 'none',
+        'profile': profile,
+        'pragmas': pragmas,
+        'series': strategy_name + (' (cached)' if cached else '') + (' (cold)' if cold else ''),
+        'repeat': repeat,
+        'warmup': warmup,
+        'seed': options['seed'],
+        'params_from': label,
+        'params': params[warmup:],
+        'total_s': sum(times_ms) / 1000,
+    }
+    record.update(summarize(times_ms))
+    #With the statement cache disabled every execute pays the prepare again
+    step_ms = record['mean_ms']
+    if options['statement_cache'] == 0:
+        step_ms = max(step_ms - prepare_ms, 0.0)
+    if engine is not None:
+        record['build_ms'] = build_ms
+    if indexes:
+        record['indexes'] = [index_name(statement) for statement in indexes]
+        record['index_ms'] = index_ms
+        record['index_bytes'] = index_bytes
+        record['index_pages'] = pages
+    record['setup_ms'] = setup_ms
+    if indexes or 'setup' in strategy:
+        record['build_cost_ms'] = index_ms + setup_ms
+    record['plan'] = plan
+    record['plan_hash'] = plan_hash(plan) if plan is not None else None
+    record['statement_cache'] = options['statement_cache']
+    record['prepare_ms'] = prepare_ms
+    record['step_ms'] = step_ms
+    record['prepare_share'] = prepare_ms / (prepare_ms + step_ms) if prepare_ms + step_ms > 0 else 0.0
+    #Summed over the timed runs; bytes and faults per query are io / repeat
+    record['io'] = io
+    #Summed the same way; the sqlite3 module exposes no page cache hit/miss
+    #counts, syscr in io is the closest stand-in for misses
+    if counters is not None:
+        counters['cache_hits'] = None
+        counters['cache_misses'] = None
+    record['counters'] = counters
+    record['times_ms'] = times_ms
+    record['rows'] = rows
+    if digests:
+        record['digests'] = digests
+    if cache is not None:
+        record['cache_hits'] = cache['hits']
+        record['cache_misses'] = cache['misses']
+    return record
+
+
+def print_cell(record):
+    io = record['io']
+    print(f"{record['query']} {record['database']} {record['series']}: "
+          f"mean {record['mean_ms']:.3f} ms "
+          f"[{record['ci_low_ms']:.3f}, {record['ci_high_ms']:.3f}] "
+          f"p50 {record['p50_ms']:.3f} p95 {record['p95_ms']:.3f} p99 {record['p99_ms']:.3f} "
+          f"prepare {record['prepare_ms']:.3f} ms ({record['prepare_share']:.0%})"
+          + (f" indexes {record['index_ms']:.1f} ms {record['index_bytes'] / 1024:.0f} KiB"
+             if 'index_ms' in record else '')
+          + f" io {io.get('read_bytes', 0) / 1024:.0f} KiB read"
+            f" {io.get('syscr', 0)} syscr {io['majflt']}/{io['minflt']} faults"
+          + counter_summary(record))
+    return
+
+
+def counter_summary(record):
+    #Per query averages of the engine counters
+    counters = record['counters']
+    if counters is None:
+        return ''
+    repeat = record['repeat']
+    if counters['source'] == 'progress_handler':
+        return f" vm ~{counters['vm_steps'] / repeat:,.0f} steps"
+    return (f" vm {counters['vm_steps'] / repeat:,.0f} steps"
+            f" scan {counters['full_scan_steps'] / repeat:,.0f}"
+            f" sort {counters['sorts'] / repeat:,.1f}"
+            f" autoidx {counters['auto_index_rows'] / repeat:,.0f} rows")
+
+
+def run_matrix(query, databases=DATABASES, strategies=DEFAULT_STRATEGIES, options=None):
+    options = dict(OPTIONS, **(options or {}))
+    strategies = [name for name in strategies if applies(query, name)]
+    #Break-even needs the baseline's own cells whenever something has a build cost
+    baseline = options['baseline']
+    if (baseline not in strategies and applies(query, baseline)
+            and any(STRATEGIES[name]['indexes'] or 'setup' in STRATEGIES[name] for name in strategies)):
+        strategies.insert(0, baseline)
+    variants = {'off': (False,), 'on': (True,), 'both': (False, True)}[options['cache']]
+    modes = {'warm': (False,), 'cold': (True,), 'both': (False, True)}[options['mode']]
+    if not options['profiles']:
+        options['profiles'] = OPTIONS['profiles']
+    for label, path in databases:
+        recover(path, query)
+        if any(not STRATEGIES[name]['constraints'] for name in strategies):
+            recover(ensure_twin(path), query)
+
+    params = {label: draw_params(query, path, options['warmup'] + options['repeat'], options['seed'])
+              for label, path in databases}
+
+    #With memory on, the cells run against in-memory copies made once here;
+    #closing the keepers at the end frees them
+    targets = databases
+    keepers = []
+    if options['memory']:
+        targets = []
+        for label, path in databases:
+            uri, keeper = load_into_memory(path)
+            keepers.append(keeper)
+            if any(not STRATEGIES[name]['constraints'] for name in strategies):
+                keepers.append(load_into_memory(twin_path(path))[1])
+            targets.append((label, uri))
+
+    results = []
+    try:
+        for profile in options['profiles']:
+            cell_options = dict(options, profile=profile)
+            for label, path in targets:
+                for strategy_name in strategies:
+                    for cached, cold in [(c, m) for c in variants for m in modes]:
+                        if not applies(query, strategy_name, cached):
+                            continue
+                        #Cold runs open a new connection per query, which neither an
+                        #engine's in-memory structure nor the per-connection scalar
+                        #cache survives; on a shared-cache memory database the new
+                        #connection still shares the warm page cache, so none is cold
+                        if cold and (cached or 'engine' in STRATEGIES[strategy_name] or options['memory']):
+                            continue
+                        record = run_cell(query, label, path, strategy_name, params[label], cell_options,
+                                          cached, cold)
+                        if len(options['profiles']) > 1:
+                            record['series'] += f' [{profile}]'
+                        print_cell(record)
+                        results.append(record)
+    finally:
+        for keeper in keepers:
+            keeper.close()
+
+    break_even(results, options['baseline'])
+    for record in results:
+        if record.get('break_even') is not None:
+            print(f"{record['query']} {record['database']} {record['series']}: "
+                  f"built in {record['build_cost_ms']:.1f} ms"
+                  f" (indexes {record.get('index_ms', 0.0):.1f} ms, setup {record['setup_ms']:.1f} ms), "
+                  f"{record['saving_ms']:.3f} ms saved per query vs {record['baseline']}, "
+                  f"break-even after {record['break_even']} queries")
+            for name, size in (record.get('index_pages') or {}).items():
+                print(f"  {name}: {size['pages']} pages, {size['bytes'] / 1024:.0f} KiB")
+    compare_plans(results, options['plan_baseline'], options['update_plan_baseline'])
+    return check_results(results)
+
+
+def plot_results(results, filename, ylim=None):
+    databases = list(dict.fromkeys(r['database'] for r in results))
+    strategies = list(dict.fromkeys(r['series'] for r in results))
+    cells = {(r['database'], r['series']): r for r in results}
+
+    x = np.arange(len(databases))  # the label locations
+    width = 0.8 / len(strategies)  # the width of the bars
+    multiplier = 0
+
+    fig, ax = plt.subplots()
+
+    for strategy in strategies:
+        offset = width * multiplier
+        cell = [cells[(db, strategy)] for db in databases]
+        measurement = [c['mean_ms'] for c in cell]
+        #Error bars span the bootstrap confidence interval of the mean
+        error = [[c['mean_ms'] - c['ci_low_ms'] for c in cell],
+                 [c['ci_high_ms'] - c['mean_ms'] for c in cell]]
+        rects = ax.bar(x + offset, measurement, width, yerr=error, capsize=3, label=strategy)
+        ax.bar_label(rects, fmt='%.3g', padding=3)
+        multiplier += 1
+
+    # Add some text for labels, title and custom x-axis tick labels, etc.
+    ax.set_ylabel('Avg Time (ms)')
+    ax.set_title('Query Runtime')
+    ax.set_xticks(x + width * (len(strategies) - 1) / 2, databases)
+    ax.legend(loc='upper left', ncols=3)
+    if ylim is not None:
+        ax.set_ylim(0, ylim)
+
+    plt.savefig(filename)
+    plt.close(fig)
+    return
+
+
+def save_results(results, filename):
+    with open(filename, 'w') as f:
+        json.dump(results, f, indent=2)
+    return
+
+
+def parse_database(value):
+    label, sep, path = value.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError(f"expected LABEL=PATH, got {value!r}")
+    return (label, path)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Runs the query across the database x strategy matrix')
+    parser.add_argument('--repeat', type=int, default=REPEAT,
+                        help='timed executions per cell')
+    parser.add_argument('--warmup', type=int, default=WARMUP,
+                        help='untimed executions per cell before timing starts')
+    parser.add_argument('--seed', type=int, default=SEED,
+                        help='seed for the pre-drawn query parameters')
+    parser.add_argument('--drain', choices=('fetchall', 'count'), default='fetchall',
+                        help='fetch every result row (and check results) or only stream-count them')
+    parser.add_argument('--cache', choices=('off', 'on', 'both'), default='off',
+                        help='run queries with cached_sql through the scalar cache, without it, or both')
+    parser.add_argument('--statement-cache', type=int, metavar='N',
+                        help='compiled statements cached per connection (0 re-prepares every execute)')
+    parser.add_argument('--mode', choices=('warm', 'cold', 'both'), default='warm',
+                        help='warm steady state on one connection, a fresh connection per query, or both')
+    parser.add_argument('--evict', choices=('none', 'fadvise', 'copy'), default='none',
+                        help='cold runs: also drop the file from the OS cache, or read a freshly copied file')
+    parser.add_argument('--profile', dest='profiles', action='append', choices=tuple(PROFILES),
+                        help='PRAGMA profile to run the matrix under (repeatable, default: default)')
+    parser.add_argument('--memory', action='store_true',
+                        help='copy each database into memory with the backup API and run every cell there')
+    parser.add_argument('--baseline', choices=tuple(STRATEGIES), default='No-Index',
+                        help='strategy index build time is paid back against for the break-even count')
+    parser.add_argument('--plan-baseline', metavar='JSON',
+                        help='stored query plans to flag each cell\'s plan against')
+    parser.add_argument('--update-plan-baseline', action='store_true',
+                        help='write this run\'s plans into the --plan-baseline file')
+    parser.add_argument('--db', type=parse_database, action='append', metavar='LABEL=PATH',
+                        help='database to run against (repeatable, replaces the default tiers)')
+    parser.add_argument('--strategy', action='append', choices=tuple(STRATEGIES),
+                        help='strategy to run (repeatable, default: %s)' % ', '.join(DEFAULT_STRATEGIES))
+    parser.add_argument('--results', metavar='JSON',
+                        help='write the per-cell result records to this file')
+    parser.add_argument('--chart', metavar='PNG',
+                        help='override the chart file name')
+    args = parser.parse_args(argv)
+    if args.memory and args.mode != 'warm':
+        parser.error('--memory runs share one warm page cache, so only --mode warm applies')
+    if args.update_plan_baseline and not args.plan_baseline:
+        parser.error('--update-plan-baseline needs --plan-baseline')
+    return args
+
+
+def main(query, chart=None, ylim=None, databases=DATABASES, argv=None):
+    args = parse_args(argv)
+    options = {name: getattr(args, name) for name in OPTIONS}
+    results = run_matrix(query,
+                         args.db or databases,
+                         args.strategy or DEFAULT_STRATEGIES,
+                         options)
+    if args.results:
+        save_results(results, args.results)
+    if args.chart or chart:
+        plot_results(results, args.chart or chart, ylim)
+    return results
@@ -0,0 +1,158 @@
+### Columnar NumPy snapshot of the four tables and vectorized Q1-Q4 ###
+
+# Every key column is dictionary-encoded: the sorted distinct ids of a domain
+# (customer, order, seller) are stored once and each column holds int32 codes
+# into them. The arrays are saved as .npy files in <database>.columnar/ and
+# memory-mapped back, and rebuilt only when the table row counts change.
+
+import json
+import os
+import numpy as np
+
+COLUMNS = {
+    'Customers': ('customer_id', 'customer_postal_code'),
+    'Sellers': ('seller_id', 'seller_postal_code'),
+    'Orders': ('order_id', 'customer_id'),
+    'Order_items': ('order_id', 'order_item_id', 'seller_id'),
+}
+
+
+def snapshot_dir(path):
+    #./A3Small.db -> ./A3Small.columnar
+    return os.path.splitext(path)[0] + '.columnar'
+
+
+def table_signature(cursor):
+    return {table: list(cursor.execute(f'SELECT count(*), max(rowid) FROM {table};').fetchone())
+            for table in COLUMNS}
+
+
+def read_table(cursor, table):
+    rows = cursor.execute('SELECT {} FROM {};'.format(', '.join(COLUMNS[table]), table)).fetchall()
+    return [np.array([row[i] for row in rows]) for i in range(len(COLUMNS[table]))]
+
+
+def encode(*columns):
+    #One sorted dictionary for every column of a key domain, plus their codes
+    keys = np.unique(np.concatenate(columns))
+    return keys, [np.searchsorted(keys, col).astype(np.int32) for col in columns]
+
+
+def build_snapshot(cursor, directory=None):
+    cust_id, cust_postal = read_table(cursor, 'Customers')
+    sell_id, sell_postal = read_table(cursor, 'Sellers')
+    ord_id, ord_cust = read_table(cursor, 'Orders')
+    item_order, item_number, item_seller = read_table(cursor, 'Order_items')
+
+    customer_keys, (cust_code, ord_cust_code) = encode(cust_id, ord_cust)
+    order_keys, (ord_code, item_order_code) = encode(ord_id, item_order)
+    seller_keys, (sell_code, item_seller_code) = encode(sell_id, item_seller)
+
+    #Attributes looked up by code; -1 marks ids referenced but missing from
+    #their own table, which an inner join would drop
+    customer_postal = np.full(len(customer_keys), -1, dtype=np.int64)
+    customer_postal[cust_code] = cust_postal
+    seller_postal = np.full(len(seller_keys), -1, dtype=np.int64)
+    seller_postal[sell_code] = sell_postal
+    order_size = np.bincount(item_order_code, minlength=len(order_keys)).astype(np.int32)
+
+    arrays = {
+        'customer_keys': customer_keys,
+        'order_keys': order_keys,
+        'seller_keys': seller_keys,
+        'cust_code': cust_code,
+        'cust_postal': cust_postal.astype(np.int64),
+        'customer_postal': customer_postal,
+        'seller_postal': seller_postal,
+        'ord_code': ord_code,
+        'ord_cust_code': ord_cust_code,
+        'item_order_code': item_order_code,
+        'item_number': item_number.astype(np.int32),
+        'item_seller_code': item_seller_code,
+        'order_size': order_size,
+    }
+    if directory is None:
+        return arrays
+    os.makedirs(directory, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, name + '.npy'), array)
+    with open(os.path.join(directory, 'signature.json'), 'w') as f:
+        json.dump(table_signature(cursor), f)
+    return arrays
+
+
+def load_snapshot(directory, mmap=True):
+    snapshot = {}
+    for name in os.listdir(directory):
+        if name.endswith('.npy'):
+            snapshot[name[:-4]] = np.load(os.path.join(directory, name), mmap_mode='r' if mmap else None)
+    return with_average(snapshot)
+
+
+def with_average(snapshot):
+    sizes = snapshot['order_size']
+    with_items = sizes[sizes > 0]
+    snapshot['avg_size'] = float(with_items.mean()) if len(with_items) else 0.0
+    return snapshot
+
+
+def snapshot_is_current(cursor, directory):
+    try:
+        with open(os.path.join(directory, 'signature.json')) as f:
+            return json.load(f) == table_signature(cursor)
+    except (OSError, ValueError):
+        return False
+
+
+def build_index(cursor):
+    #Engine entry point for the harness: load the snapshot of the connected
+    #database, building it first if it is missing or stale
+    path = cursor.execute('PRAGMA database_list;').fetchone()[2]
+    if not path:
+        #In-memory database: nothing to save next to, keep the arrays in memory
+        return with_average(build_snapshot(cursor))
+    directory = snapshot_dir(path)
+    if not snapshot_is_current(cursor, directory):
+        build_snapshot(cursor, directory)
+    return load_snapshot(directory)
+
+
+def postal_orders(snapshot, postal_code):
+    #Order codes of every order placed by a customer with this postal code
+    customers = snapshot['cust_code'][snapshot['cust_postal'] == postal_code]
+    return snapshot['ord_code'][np.isin(snapshot['ord_cust_code'], customers)]
+
+
+def q1(snapshot, params):
+    sizes = snapshot['order_size'][postal_orders(snapshot, params[0])]
+    return [(int((sizes > 1).sum()),)]
+
+
+def q2(snapshot, params):
+    sizes = snapshot['order_size'][postal_orders(snapshot, params[0])]
+    return [(int((sizes > snapshot['avg_size']).sum()),)]
+
+
+def q3(snapshot, params):
+    orders = postal_orders(snapshot, params[0])
+    orders = np.unique(orders[snapshot['order_size'][orders] > snapshot['avg_size']])
+    return [(key,) for key in snapshot['order_keys'][orders].tolist()]
+
+
+def q4(snapshot, params):
+    keys = snapshot['customer_keys']
+    i = np.searchsorted(keys, params[0])
+    if i == len(keys) or keys[i] != params[0]:
+        return [(0,)]
+    orders = snapshot['ord_code'][snapshot['ord_cust_code'] == i]
+    sellers = snapshot['item_seller_code'][np.isin(snapshot['item_order_code'], orders)]
+    postal = snapshot['seller_postal'][sellers]
+    return [(len(np.unique(postal[postal >= 0])),)]
+
+
+ANSWERS = {
+    'Q1A3': q1,
+    'Q2A3': q2,
+    'Q3A3': q3,
+    'Q4A3': q4,
+}
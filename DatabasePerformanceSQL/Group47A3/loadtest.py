@@ -0,0 +1,443 @@
+### Concurrent read load over the Q1A3-Q4A3 mix ###
+
+# Opens each database in WAL mode, sets a strategy up once, then runs N
+# readers (threads sharing a connection pool, or processes with a connection
+# each) issuing a random mix of the queries, stepping N up to show how
+# throughput and tail latency behave as concurrency grows. With a write rate,
+# a writer thread inserts synthetic orders into a temporary copy of the
+# database alongside the readers.
+
+import argparse
+import importlib
+import multiprocessing
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import benchmark
+
+QUERIES = ('Q1A3', 'Q2A3', 'Q3A3', 'Q4A3')
+
+# Reader counts stepped through for every (database, strategy)
+CONCURRENCY = (1, 2, 4, 8)
+
+# Queries issued by each reader per step
+QUERIES_PER_READER = 200
+
+# Seconds each step runs for when a writer is running: a fixed query count
+# can be over before the writer commits anything on fast strategies
+WRITE_STEP_S = 5.0
+
+# Parameters drawn per query of the mix, cycled through by the readers
+PARAMS_PER_QUERY = 100
+
+# Items per synthetic order, drawn uniformly from this range
+ITEMS_PER_ORDER = (1, 4)
+
+
+def open_connection(path, automatic_index):
+    #check_same_thread=False so a pooled connection can be handed to whichever
+    #reader thread takes it; it is only ever used by one thread at a time
+    connection = sqlite3.connect(path, check_same_thread=False)
+    auto = 'TRUE' if automatic_index else 'FALSE'
+    connection.execute(f'PRAGMA automatic_index = {auto};')
+    return connection
+
+
+def open_pool(path, size, automatic_index):
+    pool = queue.Queue()
+    for _ in range(size):
+        pool.put(open_connection(path, automatic_index))
+    return pool
+
+
+def close_pool(pool):
+    while not pool.empty():
+        pool.get_nowait().close()
+    return
+
+
+def load_queries(names=QUERIES):
+    return [importlib.import_module(name).QUERY for name in names]
+
+
+def strategy_mix(queries, strategy_name, params):
+    #(name, sql, params) of every query of the mix. Queries the strategy does
+    #not apply to run their plain sql, so every strategy runs the same mix
+    strategy = benchmark.STRATEGIES[strategy_name]
+    if 'engine' in strategy:
+        return []
+    return [(query['name'], query[strategy.get('sql', 'sql') if benchmark.applies(query, strategy_name) else 'sql'],
+             params[query['name']])
+            for query in queries]
+
+
+def plain_queries(queries, strategy_name):
+    return [query['name'] for query in queries if not benchmark.applies(query, strategy_name)]
+
+
+def strategy_indexes(queries, strategy_name):
+    #Index lists of every query in the mix, each index created once
+    key = benchmark.STRATEGIES[strategy_name]['indexes']
+    if not key:
+        return []
+    statements = {}
+    for query in queries:
+        if benchmark.applies(query, strategy_name):
+            for statement in query.get(key, []):
+                statements.setdefault(benchmark.index_name(statement), statement)
+    return list(statements.values())
+
+
+def setup_strategy(cursor, queries, strategy_name, indexes):
+    strategy = benchmark.STRATEGIES[strategy_name]
+    benchmark.create_indexes(cursor, indexes)
+    for query in queries:
+        if 'setup' in query:
+            query['setup'](cursor)
+    if 'setup' in strategy:
+        strategy['setup'](cursor)
+    cursor.connection.commit()
+    return
+
+
+def teardown_strategy(cursor, queries, strategy_name, indexes):
+    strategy = benchmark.STRATEGIES[strategy_name]
+    if 'teardown' in strategy:
+        strategy['teardown'](cursor)
+    for query in queries:
+        if 'teardown' in query:
+            query['teardown'](cursor)
+    benchmark.drop_indexes(cursor, indexes)
+    cursor.connection.commit()
+    return
+
+
+def read_load(mix, count, seed, path=None, automatic_index=False, pool=None, start=None, duration=None):
+    #One reader: count queries picked at random from the mix, or as many as
+    #fit in duration seconds, each timed on its own. Threads borrow a
+    #connection from the shared pool, processes open their own
+    connection = pool.get() if pool is not None else open_connection(path, automatic_index)
+    cursor = connection.cursor()
+    rng = np.random.default_rng(seed)
+    latencies = []
+    try:
+        if start is not None:
+            start.wait()
+        begin = time.perf_counter()
+        i = 0
+        while i < count if duration is None else time.perf_counter() - begin < duration:
+            name, sql, params = mix[rng.integers(len(mix))]
+            start_time = time.perf_counter()
+            cursor.execute(sql, params[i % len(params)]).fetchall()
+            latencies.append((name, (time.perf_counter() - start_time) * 1000))
+            i += 1
+        end = time.perf_counter()
+    finally:
+        if pool is not None:
+            pool.put(connection)
+        else:
+            connection.close()
+    return begin, end, latencies
+
+
+def copy_database(path):
+    #The writer never touches the tier databases: each (database, strategy)
+    #gets a fresh copy next to the original, removed afterwards
+    fd, copy = tempfile.mkstemp(suffix='.db', prefix=os.path.basename(path) + '.load.',
+                                dir=os.path.dirname(os.path.abspath(path)))
+    os.close(fd)
+    source = sqlite3.connect(path)
+    target = sqlite3.connect(copy)
+    source.backup(target)
+    target.close()
+    source.close()
+    return copy
+
+
+def remove_database(path):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    return
+
+
+def key_generator(cursor, table, column):
+    #New keys in the column's declared type: the next integer for INTEGER
+    #keys, a fresh 32-char hex string for the TEXT keys builddb writes
+    types = {row[1]: row[2].upper() for row in cursor.execute(f'PRAGMA table_info({table});')}
+    if 'INT' in types[column]:
+        last = cursor.execute(f'SELECT COALESCE(max({column}), 0) FROM {table};').fetchone()[0]
+        counter = iter(range(last + 1, 2**63))
+        return lambda: next(counter)
+    return lambda: uuid.uuid4().hex
+
+
+def write_load(path, rate, stop, seed, ready):
+    #Inserts one order with its items per transaction, paced to rate orders
+    #per second, until stop is set. Customers, sellers and products are drawn
+    #from the existing rows so every foreign key holds; ready is set once
+    #they are loaded (or loading failed) so the readers start with the writes
+    connection = None
+    orders, items = 0, 0
+    latencies = []
+    try:
+        connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        cursor = connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON;')
+        customers = [row[0] for row in cursor.execute('SELECT customer_id FROM Customers;')]
+        sellers = [row[0] for row in cursor.execute('SELECT seller_id FROM Sellers;')]
+        products = [row[0] for row in cursor.execute('SELECT DISTINCT product_id FROM Order_items;')]
+        new_order_id = key_generator(cursor, 'Orders', 'order_id')
+        rng = np.random.default_rng(seed)
+        ready.set()
+
+        begin = time.perf_counter()
+        next_time = begin
+        while not stop.is_set():
+            order_id = new_order_id()
+            rows = [(order_id, n + 1, products[rng.integers(len(products))], sellers[rng.integers(len(sellers))])
+                    for n in range(int(rng.integers(*ITEMS_PER_ORDER)))]
+            start_time = time.perf_counter()
+            cursor.execute('INSERT INTO Orders (order_id, customer_id) VALUES (?,?);',
+                           (order_id, customers[rng.integers(len(customers))]))
+            cursor.executemany('INSERT INTO Order_items (order_id, order_item_id, product_id, seller_id) '
+                               'VALUES (?,?,?,?);', rows)
+            connection.commit()
+            latencies.append((time.perf_counter() - start_time) * 1000)
+            orders += 1
+            items += len(rows)
+            next_time += 1 / rate
+            stop.wait(max(next_time - time.perf_counter(), 0))
+    finally:
+        ready.set()
+        if connection is not None:
+            connection.close()
+    seconds = time.perf_counter() - begin
+    #Readers that always overlap keep checkpoints from resetting the WAL
+    wal = path + '-wal'
+    record = {
+        'write_rate': rate,
+        'orders_written': orders,
+        'items_written': items,
+        'write_s': seconds,
+        'orders_per_s': orders / seconds if seconds > 0 else 0.0,
+        'wal_bytes': os.path.getsize(wal) if os.path.exists(wal) else 0,
+    }
+    #No commits, no commit latency
+    for p in (50, 95, 99):
+        record[f'commit_p{p}_ms'] = float(np.percentile(latencies, p)) if latencies else None
+    return record
+
+
+def run_level(mix, path, automatic_index, readers, count, seed, mode='thread', duration=None):
+    if mode == 'process':
+        #Spawned, not forked: a fork could copy a lock the writer thread holds.
+        #Workers come up at different times, so they too wait on a barrier
+        #(served by a manager process) once each has its connection
+        context = multiprocessing.get_context('spawn')
+        with context.Manager() as manager:
+            start = manager.Barrier(readers)
+            with ProcessPoolExecutor(max_workers=readers, mp_context=context) as executor:
+                futures = [executor.submit(read_load, mix, count, seed + i, path, automatic_index,
+                                           start=start, duration=duration)
+                           for i in range(readers)]
+                return [future.result() for future in futures]
+
+    #All threads start together once every one holds a connection
+    pool = open_pool(path, readers, automatic_index)
+    start = threading.Barrier(readers)
+    try:
+        with ThreadPoolExecutor(max_workers=readers) as executor:
+            futures = [executor.submit(read_load, mix, count, seed + i, pool=pool, start=start,
+                                       duration=duration)
+                       for i in range(readers)]
+            return [future.result() for future in futures]
+    finally:
+        close_pool(pool)
+
+
+def summarize_level(outcomes):
+    #Throughput over the span from the first reader starting to the last one
+    #finishing; latency percentiles over every query of every reader
+    wall_s = max(o[1] for o in outcomes) - min(o[0] for o in outcomes)
+    latencies = [entry for o in outcomes for entry in o[2]]
+    times_ms = np.array([ms for _, ms in latencies])
+    record = {
+        'queries': len(times_ms),
+        'wall_s': wall_s,
+        'throughput_qps': len(times_ms) / wall_s if wall_s > 0 else float('inf'),
+        'mean_ms': float(times_ms.mean()),
+        'p50_ms': float(np.percentile(times_ms, 50)),
+        'p95_ms': float(np.percentile(times_ms, 95)),
+        'p99_ms': float(np.percentile(times_ms, 99)),
+        'max_ms': float(times_ms.max()),
+        'per_query': {},
+    }
+    for name in dict.fromkeys(name for name, _ in latencies):
+        times = np.array([ms for n, ms in latencies if n == name])
+        record['per_query'][name] = {
+            'queries': len(times),
+            'p50_ms': float(np.percentile(times, 50)),
+            'p95_ms': float(np.percentile(times, 95)),
+            'p99_ms': float(np.percentile(times, 99)),
+        }
+    return record
+
+
+def run_load(queries, databases=benchmark.DATABASES, strategies=benchmark.DEFAULT_STRATEGIES,
+             concurrency=CONCURRENCY, count=QUERIES_PER_READER, mode='thread', seed=benchmark.SEED,
+             write_rate=0, duration=None):
+    #With a writer every step runs for a fixed time instead of a query count
+    if write_rate and duration is None:
+        duration = WRITE_STEP_S
+    results = []
+    for label, path in databases:
+        for query in queries:
+            benchmark.recover(path, query)
+        if any(not benchmark.STRATEGIES[name]['constraints'] for name in strategies):
+            twin = benchmark.ensure_twin(path)
+            for query in queries:
+                benchmark.recover(twin, query)
+        params = {query['name']: benchmark.draw_params(query, path, PARAMS_PER_QUERY, seed)
+                  for query in queries}
+
+        for strategy_name in strategies:
+            strategy = benchmark.STRATEGIES[strategy_name]
+            mix = strategy_mix(queries, strategy_name, params)
+            if not mix:
+                continue
+            target = path if strategy['constraints'] else benchmark.twin_path(path)
+            if write_rate:
+                target = copy_database(target)
+            indexes = strategy_indexes(queries, strategy_name)
+
+            #WAL lets readers run alongside each other and a writer; the
+            #database's own journal mode is put back afterwards
+            connection = benchmark.connect(target)
+            cursor = connection.cursor()
+            journal_mode = cursor.execute('PRAGMA journal_mode;').fetchone()[0]
+            #Fetched so the pragma statement is finished: left open it keeps a
+            #lock that blocks readers in other processes
+            cursor.execute('PRAGMA journal_mode = WAL;').fetchone()
+            try:
+                setup_strategy(cursor, queries, strategy_name, indexes)
+                for readers in concurrency:
+                    #The readers start once the writer is ready and it keeps
+                    #going until the last one is done; its rows stay in the
+                    #copy for the next step
+                    if write_rate:
+                        stop = threading.Event()
+                        ready = threading.Event()
+                        writer = ThreadPoolExecutor(max_workers=1)
+                        writes = writer.submit(write_load, target, write_rate, stop, seed, ready)
+                        ready.wait()
+                    try:
+                        outcomes = run_level(mix, target, strategy['automatic_index'], readers, count, seed, mode,
+                                             duration)
+                    finally:
+                        if write_rate:
+                            stop.set()
+                            writer.shutdown()
+                    record = {
+                        'database': label,
+                        'path': path,
+                        'strategy': strategy_name,
+                        'readers': readers,
+                        'mode': mode,
+                        'mix': [name for name, _, _ in mix],
+                        'plain_sql': plain_queries(queries, strategy_name),
+                    }
+                    record.update(summarize_level(outcomes))
+                    if write_rate:
+                        record.update(writes.result())
+                    print(f"{label} {strategy_name} x{readers}: {record['throughput_qps']:,.1f} q/s "
+                          f"p50 {record['p50_ms']:.3f} p95 {record['p95_ms']:.3f} p99 {record['p99_ms']:.3f} "
+                          f"max {record['max_ms']:.3f} ms"
+                          + (f" ({', '.join(record['plain_sql'])} as plain sql)" if record['plain_sql'] else '')
+                          + (f" | writes {record['orders_per_s']:,.1f} orders/s "
+                             + (f"commit p50 {record['commit_p50_ms']:.3f} p99 {record['commit_p99_ms']:.3f} ms "
+                                if record['orders_written'] else 'no commits ')
+                             + f"wal {record['wal_bytes'] / 2**20:.1f} MiB"
+                             if write_rate else ''))
+                    results.append(record)
+            finally:
+                teardown_strategy(cursor, queries, strategy_name, indexes)
+                cursor.execute(f'PRAGMA journal_mode = {journal_mode};').fetchone()
+                connection.close()
+                if write_rate:
+                    remove_database(target)
+    return results
+
+
+def plot_load(results, filename):
+    #Throughput and p99 latency against the number of readers, one line per
+    #(database, strategy)
+    fig, (left, right) = plt.subplots(1, 2, figsize=(11, 4))
+    series = list(dict.fromkeys((r['database'], r['strategy']) for r in results))
+    for database, strategy in series:
+        cells = [r for r in results if (r['database'], r['strategy']) == (database, strategy)]
+        readers = [r['readers'] for r in cells]
+        left.plot(readers, [r['throughput_qps'] for r in cells], marker='o', label=f'{database} {strategy}')
+        right.plot(readers, [r['p99_ms'] for r in cells], marker='o', label=f'{database} {strategy}')
+    left.set_xlabel('Readers')
+    left.set_ylabel('Queries/sec')
+    left.set_title('Throughput')
+    right.set_xlabel('Readers')
+    right.set_ylabel('p99 (ms)')
+    right.set_title('Tail Latency')
+    right.set_yscale('log')
+    left.legend(fontsize='small')
+    fig.tight_layout()
+    plt.savefig(filename)
+    plt.close(fig)
+    return
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Runs concurrent readers over the Q1A3-Q4A3 mix')
+    parser.add_argument('--query', action='append', choices=QUERIES,
+                        help='query in the mix (repeatable, default: all four)')
+    parser.add_argument('--db', type=benchmark.parse_database, action='append', metavar='LABEL=PATH',
+                        help='database to run against (repeatable, replaces the default tiers)')
+    parser.add_argument('--strategy', action='append', choices=tuple(benchmark.STRATEGIES),
+                        help='strategy to run (repeatable, default: %s)' % ', '.join(benchmark.DEFAULT_STRATEGIES))
+    parser.add_argument('--concurrency', type=int, nargs='+', default=CONCURRENCY, metavar='N',
+                        help='reader counts to step through')
+    parser.add_argument('--queries', type=int, default=QUERIES_PER_READER,
+                        help='queries issued by each reader per step')
+    parser.add_argument('--duration', type=float, metavar='SECONDS',
+                        help='run each step for this long instead of --queries '
+                             '(default with --write-rate: %g)' % WRITE_STEP_S)
+    parser.add_argument('--mode', choices=('thread', 'process'), default='thread',
+                        help='readers as threads sharing a connection pool, or as processes')
+    parser.add_argument('--write-rate', type=float, default=0, metavar='ORDERS_PER_SEC',
+                        help='also insert synthetic orders at this rate into a temporary copy of each database')
+    parser.add_argument('--seed', type=int, default=benchmark.SEED)
+    parser.add_argument('--results', metavar='JSON', help='write the per-step records to this file')
+    parser.add_argument('--chart', metavar='PNG', help='plot throughput and p99 against readers')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    queries = load_queries(args.query or QUERIES)
+    results = run_load(queries, args.db or benchmark.DATABASES, args.strategy or benchmark.DEFAULT_STRATEGIES,
+                       args.concurrency, args.queries, args.mode, args.seed, args.write_rate, args.duration)
+    if args.results:
+        benchmark.save_results(results, args.results)
+    if args.chart:
+        plot_load(results, args.chart)
+    return results
+
+
+if __name__ == "__main__":
+    main()
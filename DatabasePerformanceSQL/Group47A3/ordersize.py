@@ -0,0 +1,89 @@
+### Materialized OrderSize summary maintained by triggers ###
+
+# MatOrderSize holds the item count of every order, keyed (and clustered) by
+# order id, and MatOrderSizeStats the totals behind the global average size.
+# Triggers on Order_items keep both current, so the per-order GROUP BY of
+# Q1-Q3 becomes a primary key lookup and AVG(size) a single-row read.
+
+AVG_SIZE = '(SELECT items * 1.0 / orders FROM MatOrderSizeStats WHERE id = 0)'
+
+
+def create_order_size(cursor):
+    #Same declared type as Order_items.order_id so joins compare like for like
+    columns = {row[1]: row[2] for row in cursor.execute('PRAGMA table_info(Order_items);')}
+    cursor.execute(f'''
+                    CREATE TABLE MatOrderSize (
+                                oid {columns['order_id']},
+                                size INTEGER NOT NULL,
+                                PRIMARY KEY(oid)
+                                ) WITHOUT ROWID;
+                    ''')
+    cursor.execute('''
+                    CREATE TABLE MatOrderSizeStats (
+                                id INTEGER PRIMARY KEY CHECK (id = 0),
+                                orders INTEGER NOT NULL,
+                                items INTEGER NOT NULL
+                                );
+                    ''')
+    cursor.execute('''
+                    INSERT INTO MatOrderSize (oid, size)
+                    SELECT order_id, COUNT(*)
+                    FROM Order_items
+                    GROUP BY order_id;
+                    ''')
+    cursor.execute('''
+                    INSERT INTO MatOrderSizeStats (id, orders, items)
+                    SELECT 0, COUNT(*), COALESCE(SUM(size), 0)
+                    FROM MatOrderSize;
+                    ''')
+
+    cursor.execute('''
+                    CREATE TRIGGER MatOrderSize_insert AFTER INSERT ON Order_items
+                    BEGIN
+                        INSERT INTO MatOrderSize (oid, size) VALUES (new.order_id, 1)
+                            ON CONFLICT(oid) DO UPDATE SET size = size + 1;
+                        UPDATE MatOrderSizeStats
+                        SET items = items + 1,
+                            orders = orders + (SELECT size = 1 FROM MatOrderSize WHERE oid = new.order_id)
+                        WHERE id = 0;
+                    END;
+                    ''')
+    cursor.execute('''
+                    CREATE TRIGGER MatOrderSize_delete AFTER DELETE ON Order_items
+                    BEGIN
+                        UPDATE MatOrderSize SET size = size - 1 WHERE oid = old.order_id;
+                        UPDATE MatOrderSizeStats
+                        SET items = items - 1,
+                            orders = orders - (SELECT size = 0 FROM MatOrderSize WHERE oid = old.order_id)
+                        WHERE id = 0;
+                        DELETE FROM MatOrderSize WHERE oid = old.order_id AND size = 0;
+                    END;
+                    ''')
+    #Moving an item to another order is a delete from one and an insert into the other
+    cursor.execute('''
+                    CREATE TRIGGER MatOrderSize_update AFTER UPDATE OF order_id ON Order_items
+                    WHEN old.order_id IS NOT new.order_id
+                    BEGIN
+                        UPDATE MatOrderSize SET size = size - 1 WHERE oid = old.order_id;
+                        UPDATE MatOrderSizeStats
+                        SET orders = orders - (SELECT size = 0 FROM MatOrderSize WHERE oid = old.order_id)
+                        WHERE id = 0;
+                        DELETE FROM MatOrderSize WHERE oid = old.order_id AND size = 0;
+                        INSERT INTO MatOrderSize (oid, size) VALUES (new.order_id, 1)
+                            ON CONFLICT(oid) DO UPDATE SET size = size + 1;
+                        UPDATE MatOrderSizeStats
+                        SET orders = orders + (SELECT size = 1 FROM MatOrderSize WHERE oid = new.order_id)
+                        WHERE id = 0;
+                    END;
+                    ''')
+    cursor.connection.commit()
+    return
+
+
+def drop_order_size(cursor):
+    cursor.execute('DROP TRIGGER IF EXISTS MatOrderSize_insert;')
+    cursor.execute('DROP TRIGGER IF EXISTS MatOrderSize_delete;')
+    cursor.execute('DROP TRIGGER IF EXISTS MatOrderSize_update;')
+    cursor.execute('DROP TABLE IF EXISTS MatOrderSize;')
+    cursor.execute('DROP TABLE IF EXISTS MatOrderSizeStats;')
+    return
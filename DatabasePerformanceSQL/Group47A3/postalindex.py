@@ -0,0 +1,74 @@
+### Postal code -> orders inverted index for the Q1-Q3 access pattern ###
+
+# Q1-Q3 all start from customer_postal_code = ? and join Customers -> Orders,
+# then look at each order's item count. One scan groups every order under its
+# customer's postal code (CSR layout: sorted codes, offsets into flat per-order
+# arrays), so each query becomes a binary search plus a vectorized filter over
+# a few entries: a lower bound to hold SQLite's plans against.
+
+import numpy as np
+
+
+def build_index(cursor):
+    #Item counts come from the Order_items primary key, whose leading column
+    #is order_id, so this is one pass over Orders with index lookups
+    cursor.execute('''
+                    SELECT c.customer_postal_code, o.rowid, o.order_id,
+                        (SELECT COUNT(*) FROM Order_items i WHERE i.order_id = o.order_id)
+                    FROM Orders o, Customers c
+                    WHERE c.customer_id = o.customer_id
+                    ORDER BY c.customer_postal_code;
+                    ''')
+    rows = cursor.fetchall()
+    postal = np.array([row[0] for row in rows], dtype=np.int64)
+    sizes = np.array([row[3] for row in rows], dtype=np.int32)
+
+    codes, starts = np.unique(postal, return_index=True)
+    offsets = np.append(starts, len(postal)).astype(np.int64)
+
+    #Orders without items are not in Q2/Q3's OrderSize, so the average is over
+    #orders with at least one item
+    with_items = sizes[sizes > 0]
+    avg_size = float(with_items.mean()) if len(with_items) else 0.0
+
+    return {
+        'codes': codes,
+        'offsets': offsets,
+        'rowids': np.array([row[1] for row in rows], dtype=np.int64),
+        'order_ids': np.array([row[2] for row in rows], dtype=object),
+        'sizes': sizes,
+        'avg_size': avg_size,
+    }
+
+
+def lookup(index, postal_code):
+    i = np.searchsorted(index['codes'], postal_code)
+    if i == len(index['codes']) or index['codes'][i] != postal_code:
+        return slice(0, 0)
+    return slice(index['offsets'][i], index['offsets'][i + 1])
+
+
+def q1(index, params):
+    #Orders of the postal code with more than one item
+    sizes = index['sizes'][lookup(index, params[0])]
+    return [(int((sizes > 1).sum()),)]
+
+
+def q2(index, params):
+    #Orders of the postal code larger than the average order
+    sizes = index['sizes'][lookup(index, params[0])]
+    return [(int((sizes > index['avg_size']).sum()),)]
+
+
+def q3(index, params):
+    #Ids of those same orders
+    span = lookup(index, params[0])
+    keep = index['sizes'][span] > index['avg_size']
+    return [(order_id,) for order_id in index['order_ids'][span][keep]]
+
+
+ANSWERS = {
+    'Q1A3': q1,
+    'Q2A3': q2,
+    'Q3A3': q3,
+}
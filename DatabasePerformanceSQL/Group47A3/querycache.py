@@ -0,0 +1,52 @@
+### Cache for parameter-independent scalar subqueries ###
+
+# A cached value is keyed by its SQL text, PRAGMA data_version (which moves
+# when another connection commits) and a per-connection change counter bumped
+# by TEMP triggers on the tables it depends on (which catches this
+# connection's own writes, invisible to data_version).
+
+CACHED_TABLES = ('Order_items',)
+
+
+def attach_cache(cursor, tables=CACHED_TABLES):
+    cursor.execute('CREATE TEMP TABLE IF NOT EXISTS cache_epoch (n INTEGER NOT NULL);')
+    cursor.execute('DELETE FROM temp.cache_epoch;')
+    cursor.execute('INSERT INTO temp.cache_epoch VALUES (0);')
+    for table in tables:
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f'''
+                            CREATE TEMP TRIGGER IF NOT EXISTS cache_{table}_{event.lower()}
+                            AFTER {event} ON main.{table}
+                            BEGIN
+                                UPDATE cache_epoch SET n = n + 1;
+                            END;
+                            ''')
+    cursor.connection.commit()
+    return {'tables': tables, 'entries': {}, 'hits': 0, 'misses': 0}
+
+
+def detach_cache(cursor, cache):
+    for table in cache['tables']:
+        for event in ('insert', 'update', 'delete'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS temp.cache_{table}_{event};')
+    cursor.execute('DROP TABLE IF EXISTS temp.cache_epoch;')
+    cache['entries'].clear()
+    return
+
+
+def cache_version(cursor):
+    data_version = cursor.execute('PRAGMA data_version;').fetchone()[0]
+    epoch = cursor.execute('SELECT n FROM temp.cache_epoch;').fetchone()[0]
+    return (data_version, epoch)
+
+
+def cached_scalar(cursor, cache, sql):
+    version = cache_version(cursor)
+    entry = cache['entries'].get(sql)
+    if entry is not None and entry[0] == version:
+        cache['hits'] += 1
+        return entry[1]
+    cache['misses'] += 1
+    value = cursor.execute(sql).fetchone()[0]
+    cache['entries'][sql] = (version, value)
+    return value
@@ -1,12 +1,29 @@
 ## Builds the databases ##
 
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import hashlib
+import json
+import numpy as np
+import os
 import pandas as pd
-import random
 import sqlite3
+import tempfile
+import time
 
 connection = None
 cursor = None
 
+# (database path, fraction of customers kept, fraction of sellers kept)
+# Fractions above 1.0 upsample the source data with synthetic copies
+TIERS = (
+    ("./A3Small.db", 0.1, 0.16),
+    ("./A3Medium.db", 0.2, 0.24),
+    ("./A3Large.db", 0.33, 0.32),
+)
+
+SEED = 72
+
 def connect(path):
     global connection, cursor
     connection = sqlite3.connect(path)
@@ -22,10 +39,13 @@ def drop_tables():
     drop_sellers = "DROP TABLE IF EXISTS Sellers;"
     drop_orders = "DROP TABLE IF EXISTS Orders;"
     drop_items = "DROP TABLE IF EXISTS Order_items;"
+    drop_map = "DROP TABLE IF EXISTS Key_map;"
+    #Children first so the implicit deletes never violate a foreign key
+    cursor.execute(drop_items)
+    cursor.execute(drop_orders)
     cursor.execute(drop_customers)
     cursor.execute(drop_sellers)
-    cursor.execute(drop_orders)
-    cursor.execute(drop_items)
+    cursor.execute(drop_map)
 
 
 def define_tables():
@@ -76,147 +96,422 @@ def define_tables():
     return
 
 
-def insert_data(cust, sell, ord, orditem):
+def define_integer_tables():
     global connection, cursor
+    #Same tables with INTEGER surrogate keys: the single-column keys alias the
+    #rowid, so each parent table is its own primary key B-tree. Order_items
+    #stays a rowid table so its rows can still be sampled by rowid
+    customer_query = '''
+                    CREATE TABLE Customers (
+                                customer_id INTEGER PRIMARY KEY,
+                                customer_postal_code INTEGER
+                                );
+                    '''
 
-    for row in cust.itertuples():
-        cursor.execute('INSERT INTO Customers (customer_id, customer_postal_code) VALUES (?,?);',
-                       (row.customer_id, row.customer_zip_code_prefix))
-    
-    for row in sell.itertuples():
-        cursor.execute('INSERT INTO Sellers (seller_id, seller_postal_code) VALUES (?,?);',
-                       (row.seller_id, row.seller_zip_code_prefix))
-    
-    for row in ord.itertuples():
-        cursor.execute('INSERT INTO Orders (order_id, customer_id) VALUES (?,?);',
-                       (row.order_id, row.customer_id))
-    
-    for row in orditem.itertuples():
-        cursor.execute('INSERT INTO Order_items (order_id, order_item_id, product_id, seller_id) VALUES (?,?,?,?);',
-                       (row.order_id, row.order_item_id, row.product_id, row.seller_id))
-
-    connection.commit()
-    return
-
-
-def main():
-    random.seed(72)
-
-    #Get set of customer ids and seller ids for small db
-
-    small_customers = pd.read_csv("olist_customers_dataset.csv", skiprows=lambda x: x>0 and random.random() >= 0.1)
-    small_customers_data = pd.DataFrame(small_customers)
-
-    small_sellers = pd.read_csv("olist_sellers_dataset.csv", skiprows=lambda x: x>0 and random.random() >= 0.16)
-    small_sellers_data = pd.DataFrame(small_sellers)
-
-    s_c = set()
-    for row in small_customers_data.itertuples():
-        s_c.add(row.customer_id)
-
-    s_s = set()
-    for row in small_sellers_data.itertuples():
-        s_s.add(row.seller_id)
-
-
-    #Get set of customer ids and seller ids for med db
+    seller_query = '''
+                    CREATE TABLE Sellers (
+                                seller_id INTEGER PRIMARY KEY,
+                                seller_postal_code INTEGER
+                                );
+                    '''
 
-    med_customers = pd.read_csv("olist_customers_dataset.csv", skiprows=lambda x: x>0 and random.random() >= 0.2)
-    med_customers_data = pd.DataFrame(med_customers)
+    order_query = '''
+                    CREATE TABLE Orders (
+                                order_id INTEGER PRIMARY KEY,
+                                customer_id INTEGER,
+                                FOREIGN KEY(customer_id) REFERENCES Customers(customer_id)
+                                );
+                    '''
 
-    med_sellers = pd.read_csv("olist_sellers_dataset.csv", skiprows=lambda x: x>0 and random.random() >= 0.24)
-    med_sellers_data = pd.DataFrame(med_sellers)
+    item_query = '''
+                    CREATE TABLE Order_items (
+                                order_id INTEGER,
+                                order_item_id INTEGER,
+                                product_id INTEGER,
+                                seller_id INTEGER,
+                                PRIMARY KEY(order_id,order_item_id,product_id,seller_id),
+                                FOREIGN KEY(seller_id) REFERENCES Sellers(seller_id)
+                                FOREIGN KEY(order_id) REFERENCES Orders(order_id)
+                                );
+                    '''
 
-    m_c = set()
-    for row in med_customers_data.itertuples():
-        m_c.add(row.customer_id)
+    #Original hex key of every surrogate, per key domain
+    map_query = '''
+                    CREATE TABLE Key_map (
+                                domain TEXT,
+                                key TEXT,
+                                id INTEGER,
+                                PRIMARY KEY(domain,key)
+                                ) WITHOUT ROWID;
+                    '''
 
-    m_s = set()
-    for row in med_sellers_data.itertuples():
-        m_s.add(row.seller_id)
+    cursor.execute(customer_query)
+    cursor.execute(seller_query)
+    cursor.execute(order_query)
+    cursor.execute(item_query)
+    cursor.execute(map_query)
+    connection.commit()
 
+    return
 
-    #Get set of customer ids and seller ids for large db
 
-    large_customers = pd.read_csv("olist_customers_dataset.csv", skiprows=lambda x: x>0 and random.random() >= 0.33)
-    large_customers_data = pd.DataFrame(large_customers)
+# Tables in load order (parents before children) with the dataframe columns
+# that feed each table column
+LOAD_ORDER = (
+    ('Customers', ('customer_id', 'customer_postal_code'), ('customer_id', 'customer_zip_code_prefix')),
+    ('Sellers', ('seller_id', 'seller_postal_code'), ('seller_id', 'seller_zip_code_prefix')),
+    ('Orders', ('order_id', 'customer_id'), ('order_id', 'customer_id')),
+    ('Order_items', ('order_id', 'order_item_id', 'product_id', 'seller_id'),
+                    ('order_id', 'order_item_id', 'product_id', 'seller_id')),
+)
 
-    large_sellers = pd.read_csv("olist_sellers_dataset.csv", skiprows=lambda x: x>0 and random.random() >= 0.32)
-    large_sellers_data = pd.DataFrame(large_sellers)
+# PRAGMAs applied while bulk loading; the previous values are restored afterwards.
+# The rollback journal stays (in memory) so a failed load can still roll back
+LOAD_PRAGMAS = {
+    'journal_mode': 'MEMORY',
+    'synchronous': 'OFF',
+    'cache_size': -262144,  #256 MiB
+}
 
-    l_c = set()
-    for row in large_customers_data.itertuples():
-        l_c.add(row.customer_id)
+# Atomic builds write a temp file that is deleted if the load fails, so they
+# can drop the journal entirely (ROLLBACK is undefined with journal_mode OFF)
+ATOMIC_LOAD_PRAGMAS = dict(LOAD_PRAGMAS, journal_mode='OFF')
 
-    l_s = set()
-    for row in large_sellers_data.itertuples():
-        l_s.add(row.seller_id)
+BATCH_SIZE = 10000
 
 
-    #Get the orders data for each db
+def report_load(stats, label=''):
+    for table, (rows, seconds) in stats.items():
+        rate = rows / seconds if seconds > 0 else float('inf')
+        print(f"{label}{table}: {rows} rows in {seconds:.3f}s ({rate:,.0f} rows/sec)")
+    return
 
-    orders = pd.read_csv("olist_orders_dataset.csv")
-    orders_data = pd.DataFrame(orders)
 
-    small_orders_data = orders_data.loc[orders_data['customer_id'].isin(s_c)]
-    med_orders_data = orders_data.loc[orders_data['customer_id'].isin(m_c)]
-    large_orders_data = orders_data.loc[orders_data['customer_id'].isin(l_c)]
+def insert_data(cust, sell, ord, orditem):
+    global connection, cursor
+    stats = {}
 
+    start_time = time.perf_counter()
+    for row in cust.itertuples():
+        cursor.execute('INSERT INTO Customers (customer_id, customer_postal_code) VALUES (?,?);',
+                       (row.customer_id, row.customer_zip_code_prefix))
+    stats['Customers'] = (len(cust), time.perf_counter() - start_time)
 
-    #Get set of order ids for each db
+    start_time = time.perf_counter()
+    for row in sell.itertuples():
+        cursor.execute('INSERT INTO Sellers (seller_id, seller_postal_code) VALUES (?,?);',
+                       (row.seller_id, row.seller_zip_code_prefix))
+    stats['Sellers'] = (len(sell), time.perf_counter() - start_time)
 
-    s_o = set()
-    for row in small_orders_data.itertuples():
-        s_o.add(row.order_id)
+    start_time = time.perf_counter()
+    for row in ord.itertuples():
+        cursor.execute('INSERT INTO Orders (order_id, customer_id) VALUES (?,?);',
+                       (row.order_id, row.customer_id))
+    stats['Orders'] = (len(ord), time.perf_counter() - start_time)
 
-    m_o = set()
-    for row in med_orders_data.itertuples():
-        m_o.add(row.order_id)
+    start_time = time.perf_counter()
+    for row in orditem.itertuples():
+        cursor.execute('INSERT INTO Order_items (order_id, order_item_id, product_id, seller_id) VALUES (?,?,?,?);',
+                       (row.order_id, row.order_item_id, row.product_id, row.seller_id))
+    stats['Order_items'] = (len(orditem), time.perf_counter() - start_time)
 
-    l_o = set()
-    for row in large_orders_data.itertuples():
-        l_o.add(row.order_id)
+    connection.commit()
+    return stats
 
 
-    #Get the items data for each db
+def set_pragmas(pragmas):
+    global connection, cursor
+    previous = {}
+    for name, value in pragmas.items():
+        previous[name] = cursor.execute(f'PRAGMA {name};').fetchone()[0]
+        cursor.execute(f'PRAGMA {name} = {value};')
+    return previous
 
-    items = pd.read_csv("olist_order_items_dataset.csv")
-    items_data = pd.DataFrame(items)
 
-    small_items_data = items_data.loc[(items_data['order_id'].isin(s_o)) & (items_data['seller_id'].isin(s_s))]
-    med_items_data = items_data.loc[(items_data['order_id'].isin(m_o)) & (items_data['seller_id'].isin(m_s))]
-    large_items_data = items_data.loc[(items_data['order_id'].isin(l_o)) & (items_data['seller_id'].isin(l_s))]
+def batches(frame, columns, batch_size):
+    #Yield lists of plain tuples so executemany never sees pandas/numpy scalars
+    for start in range(0, len(frame), batch_size):
+        chunk = frame.iloc[start:start + batch_size]
+        yield list(zip(*(chunk[col].tolist() for col in columns)))
 
 
+def bulk_insert_data(cust, sell, ord, orditem, batch_size=BATCH_SIZE, pragmas=None):
     global connection, cursor
+    if pragmas is None:
+        pragmas = LOAD_PRAGMAS
+    frames = dict(zip(('Customers', 'Sellers', 'Orders', 'Order_items'), (cust, sell, ord, orditem)))
+    stats = {}
 
-    #small db
-    path = "./A3Small.db"
-    connect(path)
-    drop_tables()
-    define_tables()
-    insert_data(small_customers_data, small_sellers_data, small_orders_data, small_items_data)
-    connection.commit()
-    connection.close()
-
-    #med db
-    path = "./A3Medium.db"
-    connect(path)
-    drop_tables()
-    define_tables()
-    insert_data(med_customers_data, med_sellers_data, med_orders_data, med_items_data)
     connection.commit()
-    connection.close()
-
-    #large db
-    path = "./A3Large.db"
-    connect(path)
-    drop_tables()
-    define_tables()
-    insert_data(large_customers_data, large_sellers_data, large_orders_data, large_items_data)
+    previous = set_pragmas(pragmas)
+    try:
+        cursor.execute('BEGIN;')
+        for table, table_cols, frame_cols in LOAD_ORDER:
+            query = 'INSERT INTO {} ({}) VALUES ({});'.format(
+                table, ', '.join(table_cols), ','.join('?' * len(table_cols)))
+            start_time = time.perf_counter()
+            for batch in batches(frames[table], frame_cols, batch_size):
+                cursor.executemany(query, batch)
+            stats[table] = (len(frames[table]), time.perf_counter() - start_time)
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+    finally:
+        set_pragmas(previous)
+
+    return stats
+
+
+# Key domains: (domain, frame index and column defining its keys, every
+# (frame index, column) referencing them)
+KEY_DOMAINS = (
+    ('customer', (0, 'customer_id'), ((0, 'customer_id'), (2, 'customer_id'))),
+    ('seller', (1, 'seller_id'), ((1, 'seller_id'), (3, 'seller_id'))),
+    ('order', (2, 'order_id'), ((2, 'order_id'), (3, 'order_id'))),
+    ('product', (3, 'product_id'), ((3, 'product_id'),)),
+)
+
+
+def integer_path(path):
+    #./A3Small.db -> ./A3SmallInt.db
+    root, ext = os.path.splitext(path)
+    return root + 'Int' + ext
+
+
+def integer_keys(data):
+    #Replace every hex key with its 1-based position among the sorted distinct
+    #keys of its domain, so surrogates keep the order of the original keys
+    frames = [frame.copy() for frame in data]
+    key_map = []
+    for domain, (source, column), references in KEY_DOMAINS:
+        keys = pd.Index(np.sort(data[source][column].unique()))
+        for i, col in references:
+            ids = keys.get_indexer(frames[i][col])
+            if (ids < 0).any():
+                raise ValueError(f"{col} references a {domain} key missing from its table")
+            frames[i][col] = ids + 1
+        key_map.append(pd.DataFrame({'domain': domain, 'key': keys, 'id': np.arange(1, len(keys) + 1)}))
+    return tuple(frames), pd.concat(key_map, ignore_index=True)
+
+
+def insert_key_map(key_map, batch_size=BATCH_SIZE):
+    global connection, cursor
+    start_time = time.perf_counter()
+    for batch in batches(key_map, ('domain', 'key', 'id'), batch_size):
+        cursor.executemany('INSERT INTO Key_map (domain, key, id) VALUES (?,?,?);', batch)
     connection.commit()
-    connection.close()
-
+    return len(key_map), time.perf_counter() - start_time
+
+
+def database_size(path):
+    #Bytes of pages in use, the same figure for any file system; free pages
+    #left by dropping the previous tables of an in-place rebuild don't count
+    conn = sqlite3.connect(path)
+    try:
+        page_count = conn.execute('PRAGMA page_count;').fetchone()[0]
+        freelist = conn.execute('PRAGMA freelist_count;').fetchone()[0]
+        page_size = conn.execute('PRAGMA page_size;').fetchone()[0]
+    finally:
+        conn.close()
+    return (page_count - freelist) * page_size
+
+
+def scale_tiers(factors):
+    return tuple((f"./A3x{factor:g}.db", factor, factor) for factor in factors)
+
+
+def load_config(path):
+    #A json list of scale factors and/or {"path", "customers", "sellers"} tiers
+    with open(path) as f:
+        entries = json.load(f)
+    tiers = []
+    for entry in entries:
+        if isinstance(entry, dict):
+            tiers.append((entry['path'], entry['customers'], entry.get('sellers', entry['customers'])))
+        else:
+            tiers.extend(scale_tiers([entry]))
+    return tuple(tiers)
+
+
+def replicate(frame, draws, factor):
+    #floor(factor) whole copies plus one partial copy drawn with the remainder;
+    #a factor below 1.0 is just the partial copy, i.e. a plain sample
+    whole = int(np.floor(factor))
+    rest = factor - whole
+    copies = [(k, frame) for k in range(whole)]
+    if rest > 0:
+        copies.append((whole, frame.loc[draws < rest]))
+    return copies
+
+
+def synthetic_ids(ids, copy):
+    #Copy 0 keeps the real ids, later copies get new 32-char hex ids that are
+    #stable for a given (id, copy) so every reference maps the same way
+    if copy == 0:
+        return ids
+    return ids.map(lambda key: hashlib.md5(f'{key}:{copy}'.encode()).hexdigest())
+
+
+def sample_tiers(tiers=TIERS, seed=SEED):
+    rng = np.random.default_rng(seed)
+
+    #Read every csv once, shared by all tiers
+    customers = pd.read_csv("olist_customers_dataset.csv")
+    sellers = pd.read_csv("olist_sellers_dataset.csv")
+    orders = pd.read_csv("olist_orders_dataset.csv", usecols=['order_id', 'customer_id'])
+    items = pd.read_csv("olist_order_items_dataset.csv",
+                        usecols=['order_id', 'order_item_id', 'product_id', 'seller_id'])
+
+    #One independent uniform draw per (tier, row), all taken up front so the
+    #sample only depends on the seed and the tier list
+    cust_draws = rng.random((len(tiers), len(customers)))
+    sell_draws = rng.random((len(tiers), len(sellers)))
+
+    samples = []
+    for i, (_, cust_frac, sell_frac) in enumerate(tiers):
+        if cust_frac <= 0 or sell_frac <= 0:
+            raise ValueError(f"tier fractions must be positive, got {cust_frac}, {sell_frac}")
+        cust_copies = replicate(customers, cust_draws[i], cust_frac)
+        sell_copies = replicate(sellers, sell_draws[i], sell_frac)
+
+        tier_sellers = [sub.assign(seller_id=synthetic_ids(sub['seller_id'], k))
+                        for k, sub in sell_copies]
+        tier_customers, tier_orders, tier_items = [], [], []
+        for k, sub in cust_copies:
+            #Items of customer copy k reference seller copy k (wrapping around),
+            #and are kept only if that seller made it into the copy
+            s_k, s_sub = sell_copies[k % len(sell_copies)]
+            sub_orders = orders.loc[orders['customer_id'].isin(sub['customer_id'])]
+            sub_items = items.loc[(items['order_id'].isin(sub_orders['order_id']))
+                                  & (items['seller_id'].isin(s_sub['seller_id']))]
+            tier_customers.append(sub.assign(customer_id=synthetic_ids(sub['customer_id'], k)))
+            tier_orders.append(sub_orders.assign(order_id=synthetic_ids(sub_orders['order_id'], k),
+                                                 customer_id=synthetic_ids(sub_orders['customer_id'], k)))
+            tier_items.append(sub_items.assign(order_id=synthetic_ids(sub_items['order_id'], k),
+                                               seller_id=synthetic_ids(sub_items['seller_id'], s_k)))
+
+        samples.append(tuple(pd.concat(parts, ignore_index=True)
+                             for parts in (tier_customers, tier_sellers, tier_orders, tier_items)))
+
+    return samples
+
+
+def file_mode(path):
+    #Mode a database written in place would get: the existing file's, or the
+    #default for a new file under the current umask
+    if os.path.exists(path):
+        return os.stat(path).st_mode & 0o777
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def build_database(path, data, atomic=False, integer=False, loader='bulk'):
+    global connection, cursor
+    start_time = time.perf_counter()
+    key_map = None
+    if integer:
+        data, key_map = integer_keys(data)
+
+    #Atomic builds load into a temp file next to the target and rename it into
+    #place, so readers never see a half-built database
+    target = path
+    if atomic:
+        fd, target = tempfile.mkstemp(suffix='.tmp', prefix=os.path.basename(path) + '.',
+                                      dir=os.path.dirname(os.path.abspath(path)))
+        os.close(fd)
+
+    try:
+        connect(target)
+        drop_tables()
+        if integer:
+            define_integer_tables()
+        else:
+            define_tables()
+        if loader == 'rowwise':
+            stats = insert_data(*data)
+        else:
+            stats = bulk_insert_data(*data, pragmas=ATOMIC_LOAD_PRAGMAS if atomic else LOAD_PRAGMAS)
+        if key_map is not None:
+            stats['Key_map'] = insert_key_map(key_map)
+        connection.commit()
+        connection.close()
+        if atomic:
+            #mkstemp creates the file owner-only
+            os.chmod(target, file_mode(path))
+            os.replace(target, path)
+    except BaseException:
+        if connection is not None:
+            connection.close()
+        if atomic and os.path.exists(target):
+            os.remove(target)
+        raise
+
+    return path, stats, time.perf_counter() - start_time
+
+
+def build_all(tiers, samples, jobs=1, atomic=False, keys='text', loader='bulk'):
+    start_time = time.perf_counter()
+    results = []
+
+    #(path, sample, integer keys) for every file to write
+    builds = []
+    for tier, data in zip(tiers, samples):
+        if keys in ('text', 'both'):
+            builds.append((tier[0], data, False))
+        if keys in ('integer', 'both'):
+            builds.append((integer_path(tier[0]), data, True))
+
+    if jobs > 1:
+        #The files share no state, so each one is written by its own process;
+        #submit the largest first so it is never left waiting for a worker
+        order = sorted(range(len(builds)), key=lambda i: -len(builds[i][1][3]))
+        with ProcessPoolExecutor(max_workers=min(jobs, len(builds))) as pool:
+            futures = [pool.submit(build_database, builds[i][0], builds[i][1], atomic, builds[i][2], loader)
+                       for i in order]
+            results = [future.result() for future in futures]
+    else:
+        for path, data, integer in builds:
+            results.append(build_database(path, data, atomic, integer, loader))
+
+    for path, stats, seconds in results:
+        report_load(stats, f"{path} ")
+        print(f"{path}: built in {seconds:.3f}s, {database_size(path) / 2**20:.2f} MiB")
+    print(f"Total build time: {time.perf_counter() - start_time:.3f}s")
+
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Builds the databases')
+    parser.add_argument('--seed', type=int, default=SEED,
+                        help='seed for the tier sampling')
+    tiers = parser.add_mutually_exclusive_group()
+    tiers.add_argument('--scale', type=float, nargs='+', metavar='FACTOR',
+                       help='build one ./A3x<FACTOR>.db per scale factor instead of the default tiers')
+    tiers.add_argument('--config', metavar='JSON',
+                       help='json list of scale factors and/or {"path", "customers", "sellers"} tiers')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='number of worker processes, one database file each')
+    parser.add_argument('--atomic', action='store_true',
+                        help='write each database to a temp file and rename it into place')
+    parser.add_argument('--keys', choices=('text', 'integer', 'both'), default='text',
+                        help='hex TEXT keys, INTEGER surrogate keys in ./A3<Tier>Int.db, or both')
+    parser.add_argument('--loader', choices=('rowwise', 'bulk'), default='bulk',
+                        help='one execute per row, or batched executemany in a single transaction')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    tiers = TIERS
+    if args.config:
+        tiers = load_config(args.config)
+    if args.scale:
+        tiers = scale_tiers(args.scale)
+    samples = sample_tiers(tiers, args.seed)
+    build_all(tiers, samples, args.jobs, args.atomic, args.keys, args.loader)
     return
 
 